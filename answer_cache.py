@@ -0,0 +1,101 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from sqlite_db import get_db
+
+# 回答快取：同一個模型、同一個 system prompt、同一份檔案（內容 hash）、同樣的對話記憶、同樣的問題，就直接沿用之前的回答。
+# 存在本機 SQLite，所有 session 共用、重啟後也還在；有 TTL（過期就重問）和 LRU（超過筆數刪最久沒用的）。
+
+ANSWER_CACHE_DB = os.environ.get("ANSWER_CACHE_DB", "answer_cache.db")
+ANSWER_CACHE_TTL = int(os.environ.get("ANSWER_CACHE_TTL", 7 * 24 * 3600))
+ANSWER_CACHE_MAX_ENTRIES = int(os.environ.get("ANSWER_CACHE_MAX_ENTRIES", 5000))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS answers (
+    key TEXT PRIMARY KEY,
+    answer TEXT NOT NULL,
+    extra TEXT,
+    created REAL NOT NULL,
+    last_used REAL NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_answers_last_used ON answers (last_used);
+"""
+
+_SPACE_RE = re.compile(r"\s+")
+_TRAILING_PUNCT = " ?？!！。.~～"
+
+
+def normalize_question(question):
+    # 全形半形統一、大小寫統一、多餘空白和句尾標點去掉，「退款怎麼申請？」和「退款怎麼申請」算同一題
+    text = unicodedata.normalize("NFKC", question).lower()
+    return _SPACE_RE.sub(" ", text).strip().rstrip(_TRAILING_PUNCT)
+
+
+def make_answer_key(model, system_prompt, question, doc_hash="", context_hash=""):
+    """context_hash 是這次帶進去的對話記憶（摘要 + 最近幾輪）的 hash，前面聊過什麼不一樣就不會共用回答。"""
+    parts = [model, system_prompt, normalize_question(question), doc_hash or ""]
+    if context_hash:
+        parts.append(context_hash)   # 沒有對話記憶時 key 跟以前一樣，舊的快取還能用
+    payload = json.dumps(parts, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class AnswerCache:
+    def __init__(self, path=ANSWER_CACHE_DB, ttl=ANSWER_CACHE_TTL, max_entries=ANSWER_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._db = get_db(path)
+        with self._db.transaction() as conn:
+            conn.executescript(_SCHEMA)
+
+    def get(self, key):
+        """命中就回傳 (回答, 附加資料)，沒有或已過期回傳 None。"""
+        now = time.time()
+        with self._db.transaction() as conn:
+            row = conn.execute("SELECT answer, extra, created FROM answers WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            answer, extra, created = row
+            if now - created > self.ttl:
+                conn.execute("DELETE FROM answers WHERE key = ?", (key,))
+                return None
+            conn.execute("UPDATE answers SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        return answer, json.loads(extra) if extra else None
+
+    def put(self, key, answer, extra=None):
+        now = time.time()
+        with self._db.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (key, answer, extra, created, last_used, hits) VALUES (?, ?, ?, ?, ?, 0)",
+                (key, answer, json.dumps(extra, ensure_ascii=False) if extra is not None else None, now, now),
+            )
+            # 過期的先清掉，還是超過筆數上限就把最久沒用到的刪掉
+            conn.execute("DELETE FROM answers WHERE created < ?", (now - self.ttl,))
+            conn.execute(
+                "DELETE FROM answers WHERE key IN ("
+                "SELECT key FROM answers ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def stats(self):
+        row = self._db.query("SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM answers")[0]
+        return {"entries": row[0], "hits": row[1]}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = AnswerCache()
+        return _cache
@@ -0,0 +1,188 @@
+"""離線批次問答：從 JSONL 讀問題（可附檔案），用 async client 同時送出多個請求，結果逐行寫到輸出的 JSONL。
+
+每一行輸入：{"id": "q1", "prompt": "這份合約的違約金是多少？", "file": "docs/contract.pdf"}
+id 沒給就用行號；file 可省略。中斷後用同樣的指令重跑，已經成功的 id 會自動跳過。
+批次是獨立的 process，排隊用的 RPM / TPM 限額跟網頁版不共用，預設只拿帳號限額的一半（--rpm / --tpm 可調），
+網頁版同時在用的話兩邊加起來才不會超過帳號上限。
+
+    python batch_runner.py jobs.jsonl -o results.jsonl --concurrency 8 --user batch
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+from ingest import parse_cached
+from openai_client import acall_with_retry, make_async_client
+from parse_cache import make_cache_key
+from pricing import cost_usd, count_tokens
+from rate_limiter import RATE_LIMIT_RPM, RATE_LIMIT_TPM, RequestScheduler
+from retrieval import RetrievalIndex
+from usage_ledger import get_usage_ledger
+
+DEFAULT_MODEL = "gpt-4o"
+DEFAULT_SYSTEM_PROMPT = "你是一位樂於助人的助理。"
+RETRIEVAL_TOP_K = 6
+RETRIEVAL_TOKEN_BUDGET = 2000
+BATCH_RATE_SHARE = 0.5   # 預設只用帳號 RPM / TPM 限額的這個比例，剩下的留給網頁版
+
+
+def load_api_key():
+    # 跟 Streamlit app 用同一把 key：環境變數優先，沒有的話讀 .streamlit/secrets.toml
+    if os.environ.get("OPENAI_API_KEY"):
+        return os.environ["OPENAI_API_KEY"]
+    path = os.path.join(".streamlit", "secrets.toml")
+    if os.path.exists(path):
+        import tomllib
+        with open(path, "rb") as f:
+            return tomllib.load(f).get("OPENAI_API_KEY")
+    return None
+
+
+def extract_attachment(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    name = os.path.basename(path).lower()
+    # 跟網頁版用同一套解析器（extractors），不支援的格式會丟 UnsupportedFormat，記成這筆失敗
+    return parse_cached(make_cache_key(data, name), data, name)[0].text
+
+
+def read_jobs(path):
+    jobs = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            job = json.loads(line)
+            job.setdefault("id", str(line_no))
+            jobs.append(job)
+    return jobs
+
+
+def finished_ids(path):
+    """輸出檔裡已經成功的 id，重跑時跳過。"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError:
+                continue   # 上次中斷時寫到一半的行
+            if row.get("status") == "ok":
+                done.add(str(row["id"]))
+    return done
+
+
+async def run_job(client, scheduler, job, args):
+    model = job.get("model", args.model)
+    prompt = job["prompt"]
+    started = time.perf_counter()
+    if job.get("file"):
+        # 解析檔案是 CPU 工作，丟到 thread 裡，不要卡住 event loop
+        text = await asyncio.to_thread(extract_attachment, job["file"])
+        index = await asyncio.to_thread(RetrievalIndex, text)
+        context, _ = index.build_context(prompt, top_k=RETRIEVAL_TOP_K, token_budget=args.context_tokens)
+        prompt = f"以下是使用者的檔案內容（與問題最相關的段落）：\n\n{context}\n\n問題：{job['prompt']}"
+    system = job.get("system", args.system)
+    # 照 --rpm / --tpm 排隊，併發開大也不會把帳號打到 429（批次自己的限額，跟網頁版不共用）
+    reserve = count_tokens(system, model) + count_tokens(prompt, model) + args.max_tokens
+    ticket = await asyncio.to_thread(scheduler.acquire, args.user, reserve)
+    try:
+        # 429 / 5xx 這類暫時性錯誤會退避重試，重試完還是失敗才算這筆失敗
+        response = await acall_with_retry(
+            client.chat.completions.create,
+            model=model,
+            messages=[
+                {"role": "system", "content": system},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=args.temperature,
+            max_tokens=args.max_tokens,
+        )
+    except BaseException:
+        scheduler.release(ticket)
+        raise
+    usage = response.usage
+    scheduler.release(ticket, usage.total_tokens)
+    return {
+        "answer": response.choices[0].message.content.strip(),
+        "model": model,
+        "prompt_tokens": usage.prompt_tokens,
+        "completion_tokens": usage.completion_tokens,
+        "total_tokens": usage.total_tokens,
+        "cost_usd": cost_usd(model, usage.prompt_tokens, usage.completion_tokens),
+        "latency_s": round(time.perf_counter() - started, 3),
+    }
+
+
+async def run_batch(args):
+    jobs = read_jobs(args.input)
+    done = finished_ids(args.output)
+    pending = [job for job in jobs if str(job["id"]) not in done]
+    print(f"共 {len(jobs)} 筆，已完成 {len(jobs) - len(pending)} 筆，這次要跑 {len(pending)} 筆", file=sys.stderr)
+
+    client = make_async_client(load_api_key())
+    ledger = get_usage_ledger()
+    # 批次自己一個 process，排程器跟網頁版是分開的兩個，所以限額只拿帳號的一部分；
+    # 同一個使用者的併發就交給 --concurrency 控制；排隊不設逾時
+    scheduler = RequestScheduler(rpm=args.rpm, tpm=args.tpm, per_user=args.concurrency, timeout=float("inf"))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    write_lock = asyncio.Lock()
+    totals = {"ok": 0, "error": 0, "cost_usd": 0.0}
+
+    with open(args.output, "a", encoding="utf-8") as out:
+        async def worker(job):
+            async with semaphore:
+                row = {"id": job["id"], "prompt": job["prompt"], "file": job.get("file")}
+                try:
+                    row.update(await run_job(client, scheduler, job, args))
+                    row["status"] = "ok"
+                    # 跟網頁版共用同一本帳，額度和報表才會一致
+                    await asyncio.to_thread(
+                        ledger.record, args.user, row["cost_usd"], total_tokens=row["total_tokens"], model=row["model"],
+                        prompt_tokens=row["prompt_tokens"], completion_tokens=row["completion_tokens"], kind="batch",
+                    )
+                except Exception as e:   # 單筆失敗（API、檔案解析）只記在輸出裡，不中斷整批
+                    row.update({"status": "error", "error": str(e)})
+                async with write_lock:
+                    # 一行寫完就 flush，中斷時最多只損失正在跑的那幾筆
+                    out.write(json.dumps(row, ensure_ascii=False) + "\n")
+                    out.flush()
+                    totals[row["status"]] += 1
+                    totals["cost_usd"] += row.get("cost_usd", 0.0)
+                    print(f"[{totals['ok'] + totals['error']}/{len(pending)}] {row['id']} {row['status']}", file=sys.stderr)
+
+        await asyncio.gather(*(worker(job) for job in pending))
+
+    await client.close()
+    print(f"完成：成功 {totals['ok']} 筆，失敗 {totals['error']} 筆，花費 ${round(totals['cost_usd'], 6)}", file=sys.stderr)
+    return totals
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="從 JSONL 批次送出問答")
+    parser.add_argument("input", help="輸入的 JSONL 檔")
+    parser.add_argument("-o", "--output", default="batch_results.jsonl", help="輸出的 JSONL 檔（會接在後面寫）")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="同時送出幾個請求")
+    parser.add_argument("--user", default="batch", help="記在使用量帳本上的使用者名稱")
+    parser.add_argument("--model", default=DEFAULT_MODEL)
+    parser.add_argument("--system", default=DEFAULT_SYSTEM_PROMPT, help="system prompt")
+    parser.add_argument("--max-tokens", type=int, default=1000)
+    parser.add_argument("--temperature", type=float, default=0.7)
+    parser.add_argument("--rpm", type=int, default=max(1, int(RATE_LIMIT_RPM * BATCH_RATE_SHARE)),
+                        help="批次每分鐘最多送出幾個請求（預設帳號限額的一半，跟網頁版不共用）")
+    parser.add_argument("--tpm", type=int, default=max(1, int(RATE_LIMIT_TPM * BATCH_RATE_SHARE)),
+                        help="批次每分鐘最多用掉多少 token（預設帳號限額的一半，跟網頁版不共用）")
+    parser.add_argument("--context-tokens", type=int, default=RETRIEVAL_TOKEN_BUDGET, help="附檔內容最多佔多少 token")
+    args = parser.parse_args(argv)
+    totals = asyncio.run(run_batch(args))
+    return 1 if totals["error"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
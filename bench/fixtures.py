@@ -0,0 +1,93 @@
+"""產生 benchmark 用的假文件（PDF、DOCX、XLSX、圖片），內容固定，同樣的參數每次產生的檔案都一樣。"""
+import random
+from io import BytesIO
+
+_WORDS = ["退款", "合約", "違約金", "付款", "交貨", "保固", "發票", "客服", "refund", "invoice", "policy", "warranty"]
+
+
+def sample_text(n_words, seed=0):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(_WORDS) for _ in range(n_words))
+
+
+def make_pdf(pages, lines_per_page=40, seed=0):
+    """不靠額外套件手刻的 PDF，每頁 lines_per_page 行英文（內建字型不支援中文）。"""
+    rng = random.Random(seed)
+    ascii_words = [w for w in _WORDS if w.isascii()]
+    objects = [b"<< /Type /Catalog /Pages 2 0 R >>"]
+    kids = " ".join(f"{3 + 2 * i} 0 R" for i in range(pages))
+    objects.append(f"<< /Type /Pages /Kids [{kids}] /Count {pages} >>".encode())
+    font_id = 3 + 2 * pages
+    for page in range(pages):
+        objects.append(
+            f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents {4 + 2 * page} 0 R "
+            f"/Resources << /Font << /F1 {font_id} 0 R >> >> >>".encode()
+        )
+        lines = [f"Page {page + 1} " + " ".join(rng.choice(ascii_words) for _ in range(10)) for _ in range(lines_per_page)]
+        stream = "BT /F1 10 Tf 14 TL 50 760 Td " + " ".join(f"({line}) Tj T*" for line in lines) + " ET"
+        stream = stream.encode()
+        objects.append(b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream")
+    objects.append(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    out = b"%PDF-1.4\n"
+    offsets = []
+    for number, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n".encode() + obj + b"\nendobj\n"
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return out
+
+
+def make_docx(paragraphs, words_per_paragraph=60, seed=0):
+    import docx
+    doc = docx.Document()
+    for i in range(paragraphs):
+        doc.add_paragraph(sample_text(words_per_paragraph, seed + i))
+    buf = BytesIO()
+    doc.save(buf)
+    return buf.getvalue()
+
+
+def make_xlsx(rows, seed=0):
+    import openpyxl
+    rng = random.Random(seed)
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet("訂單")
+    sheet.append(["訂單編號", "客戶", "金額", "數量", "狀態"])
+    for i in range(rows):
+        sheet.append([f"A{i:06d}", f"客戶{rng.randrange(500)}", round(rng.uniform(10, 5000), 2),
+                      rng.randrange(1, 20), rng.choice(["已付款", "未付款", "退款"])])
+    buf = BytesIO()
+    workbook.save(buf)
+    return buf.getvalue()
+
+
+def make_image(width=1600, height=1200, lines=30, seed=0):
+    """白底黑字的 PNG，給 OCR 測速用。"""
+    from PIL import Image, ImageDraw
+    image = Image.new("RGB", (width, height), "white")
+    draw = ImageDraw.Draw(image)
+    rng = random.Random(seed)
+    ascii_words = [w for w in _WORDS if w.isascii()]
+    step = max(1, height // (lines + 1))
+    for i in range(lines):
+        draw.text((40, 20 + i * step), " ".join(rng.choice(ascii_words) for _ in range(8)), fill="black")
+    buf = BytesIO()
+    image.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+# benchmark 跑的尺寸：名稱 → (副檔名, 產生函式)
+FIXTURES = {
+    "pdf_10p": (".pdf", lambda: make_pdf(10)),
+    "pdf_100p": (".pdf", lambda: make_pdf(100)),
+    "docx_50": (".docx", lambda: make_docx(50)),
+    "docx_500": (".docx", lambda: make_docx(500)),
+    "xlsx_1k": (".xlsx", lambda: make_xlsx(1000)),
+    "xlsx_50k": (".xlsx", lambda: make_xlsx(50000)),
+    "image_small": (".png", lambda: make_image(800, 600, 15)),
+    "image_large": (".png", lambda: make_image(2400, 1800, 60)),
+}
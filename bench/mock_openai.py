@@ -0,0 +1,118 @@
+"""本機假的 chat completions API，跑 benchmark 不用連網、也不花錢。
+
+    python bench/mock_openai.py --port 8765 --first-token 0.3 --per-token 0.02 --completion-tokens 80
+
+再把 OPENAI_BASE_URL 設成 http://127.0.0.1:8765/v1 就可以直接開 app 測。
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONFIG = {
+    "first_token": 0.2,          # 收到請求到第一個 token 的延遲（秒）
+    "per_token": 0.01,           # 之後每個 token 的間隔（秒）
+    "completion_tokens": 60,     # 每次回答幾個 token（不超過請求的 max_tokens）
+    "prompt_tokens": None,       # None 就用請求內容的字數粗估
+    "status": 200,               # 設成 429 / 500 可以測重試
+}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        config = self.server.config
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        with self.server.lock:
+            self.server.requests += 1
+        if config["status"] != 200:
+            self._send_json(config["status"], {"error": {"message": "mock error", "type": "mock"}})
+            return
+
+        prompt_chars = sum(len(str(m.get("content", ""))) for m in body.get("messages", []))
+        prompt_tokens = config["prompt_tokens"] or max(1, prompt_chars // 2)
+        completion_tokens = min(config["completion_tokens"], body.get("max_tokens") or config["completion_tokens"])
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        words = [f"字{i % 10}" for i in range(completion_tokens)]
+        model = body.get("model", "mock")
+        time.sleep(config["first_token"])
+
+        if not body.get("stream"):
+            time.sleep(config["per_token"] * completion_tokens)
+            self._send_json(200, {
+                "id": "mock", "object": "chat.completion", "created": int(time.time()), "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(words)}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def send(payload):
+            data = f"data: {payload}\n\n".encode("utf-8")
+            self.wfile.write(f"{len(data):x}\r\n".encode() + data + b"\r\n")
+            self.wfile.flush()
+
+        for i, word in enumerate(words):
+            if i:
+                time.sleep(config["per_token"])
+            send(json.dumps({
+                "id": "mock", "object": "chat.completion.chunk", "created": 0, "model": model,
+                "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}],
+            }, ensure_ascii=False))
+        if (body.get("stream_options") or {}).get("include_usage"):
+            send(json.dumps({"id": "mock", "object": "chat.completion.chunk", "created": 0, "model": model,
+                             "choices": [], "usage": usage}))
+        send("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def start_mock_server(port=0, **config):
+    """在背景 thread 啟動，回傳 (server, base_url)；port=0 會自動挑一個空的 port。用完呼叫 server.shutdown()。"""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    server.daemon_threads = True
+    server.config = dict(DEFAULT_CONFIG, **config)
+    server.lock = threading.Lock()
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, name="mock-openai", daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_address[1]}/v1"
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="本機假的 OpenAI chat completions API")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--first-token", type=float, default=DEFAULT_CONFIG["first_token"])
+    parser.add_argument("--per-token", type=float, default=DEFAULT_CONFIG["per_token"])
+    parser.add_argument("--completion-tokens", type=int, default=DEFAULT_CONFIG["completion_tokens"])
+    parser.add_argument("--status", type=int, default=200)
+    args = parser.parse_args(argv)
+    server, base_url = start_mock_server(
+        args.port, first_token=args.first_token, per_token=args.per_token,
+        completion_tokens=args.completion_tokens, status=args.status,
+    )
+    print(f"mock OpenAI API：{base_url}（Ctrl+C 結束）")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
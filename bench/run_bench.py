@@ -0,0 +1,279 @@
+"""離線 benchmark：檔案解析吞吐量、組 prompt 的時間、透過 AppTest 量整個送出流程的延遲和記憶體高峰。
+
+不用連網：API 換成 bench/mock_openai.py，帳本、快取、遙測、對話紀錄都寫到暫存資料夾，不會動到正式的資料。
+結果輸出成 JSON，可以跟之前的結果比較：
+
+    python bench/run_bench.py -o bench-new.json
+    python bench/run_bench.py --quick --compare bench-old.json
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 這些模組在 import 時讀環境變數，要在 import 之前先指到暫存資料夾
+_TMP = tempfile.mkdtemp(prefix="chatai-bench-")
+os.environ.update({
+    "USAGE_DB": os.path.join(_TMP, "usage.db"),
+    "ANSWER_CACHE_DB": os.path.join(_TMP, "answer_cache.db"),
+    "TELEMETRY_DB": os.path.join(_TMP, "telemetry.db"),
+    "CONVERSATION_DB": os.path.join(_TMP, "conversations.db"),
+    "PARSE_CACHE_DIR": "",
+    "OPENAI_API_KEY": "sk-bench",
+})
+os.environ.pop("METRICS_PORT", None)
+
+from fixtures import FIXTURES  # noqa: E402
+from mock_openai import start_mock_server  # noqa: E402
+
+QUICK_FIXTURES = ["pdf_10p", "docx_50", "xlsx_1k", "image_small"]
+QUESTIONS = ["退款要怎麼申請", "違約金怎麼算", "保固期多久", "發票什麼時候開", "交貨延遲怎麼辦",
+             "付款方式有哪些", "客服電話是多少", "refund policy", "warranty terms", "invoice date"]
+MIN_DELTA_S = 0.005   # 比較時差距小於這個秒數就當作誤差
+
+
+def _summary(samples):
+    samples = sorted(samples)
+    return {
+        "n": len(samples),
+        "median_s": round(statistics.median(samples), 6),
+        "p95_s": round(samples[min(len(samples) - 1, int(0.95 * len(samples)))], 6),
+        "min_s": round(samples[0], 6),
+    }
+
+
+def _git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+
+def bench_ingestion(names, repeat):
+    from extractors import extract
+    results = {}
+    for name in names:
+        ext, make = FIXTURES[name]
+        data = make()
+        samples = []
+        try:
+            for _ in range(repeat):
+                started = time.perf_counter()
+                result = extract(data, f"{name}{ext}")
+                samples.append(time.perf_counter() - started)
+        except RuntimeError as e:   # 例如沒裝 tesseract
+            results[name] = {"skipped": str(e)}
+            continue
+        # tracemalloc 本身會拖慢很多，記憶體高峰另外跑一次量
+        tracemalloc.start()
+        extract(data, f"{name}{ext}")
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        row = _summary(samples)
+        row.update({
+            "bytes": len(data),
+            "chars": len(result.text),
+            "mb_per_s": round(len(data) / 1024 / 1024 / row["median_s"], 3),
+            "peak_py_mb": round(peak / 1024 / 1024, 2),   # 只算主 process 的 Python 配置，PDF 平行解析的子 process 不在內
+            "meta": {k: v for k, v in result.meta.items() if isinstance(v, (int, float, bool))},
+        })
+        results[name] = row
+        print(f"  ingestion {name}: {row['median_s']} 秒，{row['mb_per_s']} MB/s", file=sys.stderr)
+    return results
+
+
+def bench_prompt_build(repeat):
+    from extractors import extract
+    from pricing import count_message_tokens
+    from retrieval import RetrievalIndex
+    ext, make = FIXTURES["pdf_100p"]
+    text = extract(make(), "doc" + ext).text
+
+    index_samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        index = RetrievalIndex(text)
+        index_samples.append(time.perf_counter() - started)
+
+    context_samples = []
+    token_samples = []
+    for i in range(repeat * len(QUESTIONS)):
+        question = QUESTIONS[i % len(QUESTIONS)]
+        started = time.perf_counter()
+        context, _ = index.build_context(question, top_k=6, token_budget=2000)
+        context_samples.append(time.perf_counter() - started)
+        messages = [{"role": "system", "content": "bench"}, {"role": "user", "content": f"{context}\n\n問題：{question}"}]
+        started = time.perf_counter()
+        count_message_tokens(messages, "gpt-4o")
+        token_samples.append(time.perf_counter() - started)
+    return {
+        "doc_chars": len(text),
+        "chunks": len(index.chunks),
+        "build_index": _summary(index_samples),
+        "build_context": _summary(context_samples),
+        "count_tokens": _summary(token_samples),
+    }
+
+
+def bench_submit(script, questions, server):
+    from streamlit.testing.v1 import AppTest
+
+    requests_before = server.requests
+    at = AppTest.from_file(os.path.join(ROOT, script), default_timeout=120)
+    at.secrets["passwords"] = {"ahong": "bench"}
+    at.secrets["OPENAI_API_KEY"] = "sk-bench"
+    at.session_state["authenticated"] = True
+    at.session_state["username"] = "ahong"   # 管理員沒有金額上限，跑多少輪都不會被擋
+
+    started = time.perf_counter()
+    at.run()
+    first_run = time.perf_counter() - started
+
+    def submit(question, skip_cache):
+        at.text_input[0].input(question)
+        at.checkbox[0].check() if skip_cache else at.checkbox[0].uncheck()
+        [b for b in at.button if b.label == "送出"][0].click()
+        started = time.perf_counter()
+        at.run()
+        elapsed = time.perf_counter() - started
+        if at.exception:
+            raise RuntimeError(at.exception[0].value)
+        return elapsed
+
+    def new_conversation():
+        [s for s in at.selectbox if s.label == "💬 對話"][0].select_index(0)
+        at.run()
+
+    fresh = [submit(q, True) for q in questions]
+    tracemalloc.start()
+    submit(questions[0] + "？", True)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    started = time.perf_counter()
+    at.run()
+    rerun = time.perf_counter() - started
+
+    # 對話記憶也算在快取 key 裡，只有前面聊的內容一樣才會命中：在空白的新對話裡先問一次，再開一個新對話問同一題
+    cached = []
+    for q in questions[:3]:
+        new_conversation()
+        submit(q, True)
+        new_conversation()
+        cached.append(submit(q, False))
+    result = {
+        "first_run_s": round(first_run, 6),
+        "submit": _summary(fresh),
+        "submit_cached": _summary(cached),
+        "rerun_with_history_s": round(rerun, 6),
+        "history_turns": len(fresh) + 1,
+        "api_requests": server.requests - requests_before,
+        "peak_py_mb": round(peak / 1024 / 1024, 2),
+    }
+    print(f"  submit {script}: 中位數 {result['submit']['median_s']} 秒", file=sys.stderr)
+    return result
+
+
+def _flatten(prefix, value, out):
+    if isinstance(value, dict):
+        for k, v in value.items():
+            _flatten(f"{prefix}.{k}" if prefix else k, v, out)
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        out[prefix] = value
+    return out
+
+
+def compare(old, new, threshold):
+    """耗時、記憶體類的數字（*_s、*_mb）變大超過 threshold 就列為退步。"""
+    old_flat = _flatten("", old["results"], {})
+    new_flat = _flatten("", new["results"], {})
+    regressions = []
+    for key, value in sorted(new_flat.items()):
+        base = old_flat.get(key)
+        if not base or not key.endswith(("_s", "_mb")) or key.endswith((".min_s", "mb_per_s")):
+            continue
+        ratio = value / base
+        # 毫秒以下的抖動不算退步
+        slower = ratio > 1 + threshold and (key.endswith("_mb") or value - base > MIN_DELTA_S)
+        marker = "  ⚠️" if slower else ""
+        print(f"{key}: {base} → {value}（{ratio:.2f}x）{marker}", file=sys.stderr)
+        if marker:
+            regressions.append(key)
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="chatai 離線 benchmark")
+    parser.add_argument("-o", "--output", help="結果寫到這個 JSON 檔（沒給就印在 stdout）")
+    parser.add_argument("--quick", action="store_true", help="只跑小檔案、少跑幾輪")
+    parser.add_argument("--repeat", type=int, default=None, help="每個項目重複幾次")
+    parser.add_argument("--scripts", nargs="+", default=["chat_ai.py", "chat_ai_test.py"])
+    parser.add_argument("--first-token", type=float, default=0.05, help="mock API 第一個 token 的延遲（秒）")
+    parser.add_argument("--per-token", type=float, default=0.002, help="mock API 每個 token 的間隔（秒）")
+    parser.add_argument("--compare", help="跟之前的結果 JSON 比較")
+    parser.add_argument("--threshold", type=float, default=0.2, help="變慢超過多少比例算退步")
+    args = parser.parse_args(argv)
+
+    repeat = args.repeat or (2 if args.quick else 5)
+    fixtures = QUICK_FIXTURES if args.quick else list(FIXTURES)
+    questions = QUESTIONS[:4] if args.quick else QUESTIONS
+
+    started = time.time()
+    print("檔案解析…", file=sys.stderr)
+    results = {"ingestion": bench_ingestion(fixtures, repeat)}
+    print("組 prompt…", file=sys.stderr)
+    results["prompt_build"] = bench_prompt_build(repeat)
+    print("送出問題（AppTest）…", file=sys.stderr)
+    # 整個 process 共用同一個 OpenAI client（base_url 只在第一次建立時讀），所以 mock server 也只開一個
+    server, base_url = start_mock_server(first_token=args.first_token, per_token=args.per_token)
+    os.environ["OPENAI_BASE_URL"] = base_url
+    try:
+        results["submit"] = {s: bench_submit(s, questions, server) for s in args.scripts}
+    finally:
+        server.shutdown()
+
+    report = {
+        "meta": {
+            "commit": _git_commit(),
+            "timestamp": int(started),
+            "duration_s": round(time.time() - started, 1),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "config": {"quick": args.quick, "repeat": repeat, "first_token": args.first_token, "per_token": args.per_token},
+        },
+        "results": results,
+    }
+    if sys.platform != "win32":
+        import resource
+        # Linux 是 KB、macOS 是 bytes
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        report["meta"]["max_rss_mb"] = round(maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            regressions = compare(json.load(f), report, args.threshold)
+        if regressions:
+            print(f"退步 {len(regressions)} 項：{', '.join(regressions)}", file=sys.stderr)
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,35 +1,51 @@
 import streamlit as st
-from openai import OpenAI, OpenAIError
+from openai import OpenAIError
 from datetime import date
-import json
-import os
-import docx
-import PyPDF2
-import base64
-from PIL import Image
-from openai import OpenAI
-from io import BytesIO
-import pandas as pd
-import  pytesseract
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-
-USAGE_FILE = "daily_usage.json"
-
-def load_daily_usage():
-    if os.path.exists(USAGE_FILE):
-        try:
-            with open(USAGE_FILE, "r") as f:
-                return json.load(f)
-        except Exception:
-            return {}
-    return {}
-
-def save_daily_usage(data):
-    try:
-        with open(USAGE_FILE, "w") as f:
-            json.dump(data, f)
-    except Exception as e:
-        st.error(f"儲存使用紀錄失敗：{e}")
+import time
+from openai_client import call_with_retry, get_client
+from openai_client import stats as api_stats
+from rate_limiter import PRIORITY_ADMIN, PRIORITY_NORMAL, QueueTimeout, get_scheduler
+from telemetry import get_telemetry
+from usage_ledger import get_usage_ledger
+from conversation_store import get_conversation_store
+from parse_cache import get_parse_cache
+from extractors import UnsupportedFormat, supported_extensions
+from ingest import start_ingest
+from retrieval import build_multi_context
+from doc_store import get_doc_store
+from answer_cache import get_answer_cache, make_answer_key
+from conversation_memory import (
+    MEMORY_TOKEN_BUDGET, SUMMARY_MODEL, fold_cost, fold_into_summary, fold_tokens, memory_digest, memory_messages,
+    new_memory, recent_start,
+)
+from metrics_dashboard import render_metrics_dashboard
+from model_router import get_model_router
+from pricing import affordable_completion_tokens, cost_usd, count_message_tokens, count_tokens, worst_case_cost
+
+parse_cache = get_parse_cache()
+doc_store = get_doc_store()
+usage_ledger = get_usage_ledger()
+conversations = get_conversation_store()
+answer_cache = get_answer_cache()
+scheduler = get_scheduler()
+telemetry = get_telemetry()
+router = get_model_router()
+
+MODEL = "gpt-4o"   # 對話記憶、token 計算用的預設模型；實際回答用哪個模型由 router 決定
+SYSTEM_PROMPT = "你是一位樂於助人且幹話很多的助理。"
+MAX_COMPLETION_TOKENS = 1000
+MIN_COMPLETION_TOKENS = 200   # 預算不夠時回答長度最少要留這麼多，不然乾脆不送
+
+# 對話紀錄一次顯示幾輪，更早的要按「載入更早的對話」
+HISTORY_PAGE_SIZE = 10
+
+# 每個問題最多放幾段檔案內容、最多佔多少 token；預算不夠時最少還是要附上 MIN_CONTEXT_TOKENS（而且至少放得下最長的一段）
+RETRIEVAL_TOP_K = 6
+RETRIEVAL_TOKEN_BUDGET = 2000
+MIN_CONTEXT_TOKENS = 300
+
+# 可以上傳的檔案類型（extractors 裡註冊的解析器）
+UPLOAD_TYPES = supported_extensions(("text", "csv", "html", "pdf", "docx", "pptx", "excel", "image"))
 
 st.set_page_config(page_title="問答助手", page_icon="💬")
 
@@ -38,15 +54,13 @@ for key, default in {
     "authenticated": False,
     "username": None,
     "confirm_clear": False,
-    "daily_usage": {}
 }.items():
     if key not in st.session_state:
         st.session_state[key] = default
 
-if not st.session_state.daily_usage:
-    st.session_state.daily_usage = load_daily_usage()
-
 VALID_PASSWORDS = st.secrets["passwords"]
+# 這些帳號一律不使用回答快取（每次都重新問模型）
+ANSWER_CACHE_DISABLED_USERS = set(st.secrets.get("ANSWER_CACHE_DISABLED_USERS", []))
 
 def login():
     st.title("登入頁面(測試區)")
@@ -70,10 +84,54 @@ if not st.session_state.authenticated or not st.session_state.username:
 
 username = st.session_state.username
 
-# 初始化個別用戶的 chat_history
+# 個別用戶的對話紀錄存在 conversation_store，session 裡只放目前這個對話最近載入的幾輪
 chat_key = f"chat_history_{username}"
+# 多輪對話記憶（舊對話的滾動摘要），跟著對話一起存檔，不用每次重算
+memory_key = f"memory_{username}"
+conversation_key = f"conversation_{username}"   # 目前的對話 id；None 表示還沒問第一個問題的新對話
+offset_key = f"history_offset_{username}"        # session 裡的第一輪是整個對話的第幾輪，更早的還在存檔裡
+visible_key = f"history_visible_{username}"
+
+
+def open_conversation(conversation_id):
+    """切換到某個對話：先載入最近幾輪和摘要，更早的要看時再載入；None 就是開一個新對話。"""
+    if conversation_id is None:
+        offset, turns, memory = 0, [], new_memory()
+    else:
+        offset, turns, memory = conversations.load_recent(conversation_id)
+    st.session_state[conversation_key] = conversation_id
+    st.session_state[offset_key] = offset
+    st.session_state[chat_key] = turns
+    st.session_state[memory_key] = memory
+    st.session_state[f"chat_html_{username}"] = []
+    st.session_state[visible_key] = HISTORY_PAGE_SIZE
+
+
+def add_turn(turn):
+    # 這一輪同時存檔和放進 session；新對話到第一個問題才真的建立
+    if st.session_state[conversation_key] is None:
+        st.session_state[conversation_key] = conversations.create(username)
+    seq = conversations.append(st.session_state[conversation_key], turn)
+    if seq != st.session_state[offset_key] + len(st.session_state[chat_key]):
+        # 別的分頁也在這個對話裡問了問題，session 裡的幾輪跟存檔對不上了，整個重新載入
+        open_conversation(st.session_state[conversation_key])
+    else:
+        st.session_state[chat_key].append(turn)
+
+
+def sync_conversation():
+    # 送出前先對一下存檔：別的分頁在同一個對話加了幾輪的話重新載入，
+    # 不然這次帶的對話記憶會少掉那幾輪，摘要涵蓋到第幾輪也會跟存檔的編號錯開
+    conversation_id = st.session_state[conversation_key]
+    if conversation_id is None:
+        return
+    if conversations.turn_count(conversation_id) != st.session_state[offset_key] + len(st.session_state[chat_key]):
+        open_conversation(conversation_id)
+
+
 if chat_key not in st.session_state:
-    st.session_state[chat_key] = []
+    # 登入後接著最近一次的對話
+    open_conversation(conversations.latest(username))
 
 # 登出
 if st.button("登出"):
@@ -86,7 +144,8 @@ st.title("這是測試區")
 st.success(f"歡迎 {'ASSHOLE BING 🙂' if username == 'abing' else username}！")
 
 api_key = st.secrets["OPENAI_API_KEY"]
-client = OpenAI(api_key=api_key)
+# 整個 process 共用同一個 client，rerun 不會重建，連線可以重複使用
+client = get_client(api_key)
 
 DAILY_LIMITS = {
     "ahong": None,
@@ -94,8 +153,11 @@ DAILY_LIMITS = {
     "user": 0.05,
 }
 user_limit = DAILY_LIMITS.get(username, 0.05)
+# 所有 session 共用同一個排程器，管理員的請求排在最前面
+priority = PRIORITY_ADMIN if username == "ahong" else PRIORITY_NORMAL
 today = str(date.today())
-today_used = st.session_state.daily_usage.get(today, 0.0)
+# 每次 rerun 都從帳本重新加總，別的 session 剛花掉的錢也會算進來
+today_used = usage_ledger.spent_on(username, today)
 remaining = round(user_limit - today_used, 4) if user_limit is not None else None
 
 if username == "ahong":
@@ -106,24 +168,141 @@ else:
         st.error("🚫 今日已達金額上限，請明天再來或聯絡管理員!.。")
         st.stop()
 
-def ask_openai(prompt):
+def user_bubble_html(text):
+    return f'''
+            <div style="font-size:13px; color:#555; margin-left:8px; margin-bottom:3px;">
+                <b>{'👤 ASSHOLE BING' if username == 'abing' else '👤 使用者'}</b>
+            </div>
+            <div style="background:#DCF8C6; padding:10px; border-radius:15px; max-width:75%; margin-bottom:10px;">
+                {text}
+            </div>'''
+
+
+def bot_bubble_html(text):
+    return f'''
+            <b><div style="font-size:13px; color:#555; text-align:right; margin-right:8px; margin-bottom:5px;">
+                🤖 助手
+            </div></b>
+            <div style="background:#F1F0F0; padding:10px 15px; border-radius:15px; max-width:75%; margin-left:auto; margin-bottom:10px;">
+                {text}
+            </div>'''
+
+
+def build_messages(prompt):
+    # system prompt + 先前對話摘要 + 預算內最近幾輪原文 + 這次的問題
+    return memory_messages(
+        SYSTEM_PROMPT, st.session_state[memory_key], st.session_state[chat_key], prompt, MEMORY_TOKEN_BUDGET, MODEL
+    )
+
+
+def ask_openai(prompt, placeholder=None, max_tokens=MAX_COMPLETION_TOKENS, model=MODEL):
+    # 有給 placeholder 就用串流模式，邊產生邊顯示在機器人對話框裡
+    messages = build_messages(prompt)
+    started = time.perf_counter()
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "你是一位樂於助人且幹話很多的助理。"},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.7,
-            max_tokens=1000,
-        )
-        answer = response.choices[0].message.content.strip()
-        tokens_used = response.usage.total_tokens
-        usd_cost = round(tokens_used * 0.01 / 1000, 6)
+        if placeholder is None:
+            response = call_with_retry(
+                client.chat.completions.create,
+                model=model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=max_tokens,
+            )
+            answer = response.choices[0].message.content.strip()
+            usage = response.usage
+        else:
+            # 429 / 5xx / 逾時會自動退避重試（只重試建立連線，已經開始串流就不重來）
+            stream = call_with_retry(
+                client.chat.completions.create,
+                model=model,
+                messages=messages,
+                temperature=0.7,
+                max_tokens=max_tokens,
+                stream=True,
+                stream_options={"include_usage": True},
+            )
+            parts = []
+            usage = None
+            ttft = None
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if not parts:
+                        ttft = time.perf_counter() - started
+                        telemetry.observe("ttft", ttft, username)
+                    parts.append(chunk.choices[0].delta.content)
+                    placeholder.markdown(bot_bubble_html("".join(parts) + "▌"), unsafe_allow_html=True)
+                # 最後一個 chunk 才會帶 usage（choices 是空的）
+                if chunk.usage:
+                    usage = chunk.usage
+            answer = "".join(parts).strip()
+            placeholder.markdown(bot_bubble_html(answer), unsafe_allow_html=True)
+        usage = {
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "completion_tokens": usage.completion_tokens if usage else 0,
+            "total_tokens": usage.total_tokens if usage else 0,
+        }
+        # 輸入、輸出 token 分開計價
+        usd_cost = cost_usd(model, usage["prompt_tokens"], usage["completion_tokens"])
         twd_cost = round(usd_cost * 32, 4)
-        return answer, tokens_used, usd_cost, twd_cost
+        elapsed = time.perf_counter() - started
+        telemetry.observe("generation", elapsed, username)
+        if placeholder is not None and ttft is not None:
+            router.observe(model, ttft, elapsed, usage["completion_tokens"])
+        telemetry.count("tokens_in", usage["prompt_tokens"], username)
+        telemetry.count("tokens_out", usage["completion_tokens"], username)
+        telemetry.count("cost_usd", usd_cost, username)
+        return answer, usage, usd_cost, twd_cost
     except OpenAIError as e:
-        return f"❌ API 錯誤：{str(e)}", 0, 0.0, 0.0
+        telemetry.observe("generation", time.perf_counter() - started, username, ok=False)
+        telemetry.count("api_error", 1, username)
+        return f"❌ API 錯誤：{str(e)}", {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}, 0.0, 0.0
+
+
+def queue_notice(placeholder):
+    # 排隊時顯示前面還有幾個請求、大約要等多久
+    def on_wait(position, eta):
+        if eta is None:
+            placeholder.info("⏳ 你的上一個問題還在處理中，處理完就輪到這一題…")
+        else:
+            placeholder.info(f"⏳ 目前使用的人比較多，前面還有 {position} 個請求，預估等待約 {max(1, round(eta))} 秒…")
+    return on_wait
+
+
+def plan_request(user_input, budget, model=MODEL):
+    """組出要送出的 prompt，並在呼叫 API 之前估算最壞情況的花費。
+
+    超過 budget（今日剩餘額度，None 表示不限）時，先縮減附上的檔案段落，再縮短回答長度上限；都不夠就回傳 None。
+    有勾選文件時至少要附上一段，連一段都附不上就不送出（只送問題的話回答會跟檔案無關）。
+    回傳 (prompt, 用到的段落 [(第幾份文件, 段落編號)], 預估 prompt token, max_tokens)。
+    """
+    context_budget = RETRIEVAL_TOKEN_BUDGET
+    max_tokens = MAX_COMPLETION_TOKENS
+    # 勾選的文件一起挑段落，共用同一個 token 預算；每多一份文件多給幾個段落名額
+    named_indexes = [(doc.name, doc.index()) for doc in active_docs()]
+    top_k = max(RETRIEVAL_TOP_K, 2 * len(named_indexes))
+    # 縮減的下限至少要放得下最長的一段，不然縮到底一段都挑不到
+    min_context = max([MIN_CONTEXT_TOKENS] + [int(index.chunk_tokens.max()) for _, index in named_indexes if len(index)])
+    while True:
+        if named_indexes:
+            context, used_chunks = build_multi_context(
+                named_indexes, user_input, top_k=top_k, token_budget=context_budget
+            )
+            prompt = f"以下是使用者的檔案內容（與問題最相關的段落）：\n\n{context}\n\n問題：{user_input}"
+        else:
+            prompt = user_input
+            used_chunks = []
+        if named_indexes and not used_chunks and any(len(index) for _, index in named_indexes):
+            return None
+        prompt_tokens = count_message_tokens(build_messages(prompt), model)
+        if budget is None or worst_case_cost(model, prompt_tokens, max_tokens) <= budget:
+            return prompt, used_chunks, prompt_tokens, max_tokens
+        if used_chunks and context_budget > min_context:
+            context_budget = max(min_context, context_budget // 2)
+            continue
+        affordable = affordable_completion_tokens(model, prompt_tokens, budget)
+        if affordable >= MIN_COMPLETION_TOKENS:
+            return prompt, used_chunks, prompt_tokens, min(max_tokens, affordable)
+        return None
 
 st.markdown("""
 <style>
@@ -137,138 +316,426 @@ div[data-testid="stForm"] { margin-top: 100px; }
 
 st.markdown("### 📝 對話紀錄")
 
-# ========= 顯示對話紀錄 =========
-with st.container():
-    for chat in st.session_state[chat_key]:
-        st.markdown(f'''
-            <div style="font-size:13px; color:#555; margin-left:8px; margin-bottom:3px;">
-                <b>{'👤 ASSHOLE BING' if username == 'abing' else '👤 使用者'}</b>
-            </div>
-            <div style="background:#DCF8C6; padding:10px; border-radius:15px; max-width:75%; margin-bottom:10px;">
-                {chat["question"]}
-            </div>''', unsafe_allow_html=True)
-        st.markdown(f'''
-            <b><div style="font-size:13px; color:#555; text-align:right; margin-right:8px; margin-bottom:5px;">
-                🤖 助手
-            </div></b>
-            <div style="background:#F1F0F0; padding:10px 15px; border-radius:15px; max-width:75%; margin-left:auto; margin-bottom:10px;">
-                {chat["answer"]}
-            </div>''', unsafe_allow_html=True)
-        st.markdown(f'''
-            <div style="font-size:13px; color:#666; text-align:right; margin-bottom:20px;">
-                {chat["meta"]}
-            </div>
-            <hr style="border: none; border-top: 1px dashed #ccc; margin: 15px 0;">
-            ''', unsafe_allow_html=True)
-
-
-# ========= 對話輸入表單 =========
-with st.form("chat_form", clear_on_submit=True):
-    cols = st.columns([6, 2])
-    with cols[0]:
-        user_input = st.text_input("💡 請輸入你的問題：")
-        uploaded_file = st.file_uploader("📁 上傳檔案（可選）", type=["txt", "pdf", "docx", "jpg", "jpeg", "png", "xls", "xlsx"])
-
-    with cols[1]:
-        submitted = st.form_submit_button("送出")
-
-clear_clicked = st.button("清除紀錄")
+# ========= 切換對話 =========
+conversation_list = conversations.list_conversations(username)
+# selectbox 存的是顯示的文字，標題一樣、同一分鐘的兩個對話會被當成同一個，所以文字裡帶上對話編號
+conversation_titles = {
+    c["id"]: f"#{c['id']} {c['title'] or '（無標題）'}（{c['turns']} 輪，{time.strftime('%m/%d %H:%M', time.localtime(c['updated']))}）"
+    for c in conversation_list
+}
+conversation_options = [None] + list(conversation_titles)
+pick_key = f"conversation_pick_{username}"
 
-# ==== 初始化記憶檔案內容用的 session_state ====
-import pytesseract
-from PIL import Image
-pytesseract.pytesseract.tesseract_cmd = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
-if "uploaded_file_text" not in st.session_state:
-    st.session_state.uploaded_file_text = None
-    st.session_state.uploaded_file_name = None
 
-if submitted:
-    full_prompt = user_input.strip()
+def pick_conversation():
+    open_conversation(st.session_state[pick_key])
 
-    # 如果有上傳新檔案，就重新解析並記下內容
-    if uploaded_file:
-        file_text = ""
 
-        if uploaded_file.name.endswith(".txt"):
-            file_text = uploaded_file.read().decode("utf-8", errors="ignore")
+# 只有使用者自己選了別的對話才切換（on_change）；每次都先把選單對齊目前的對話，
+# 送出第一個問題建立新對話、清除紀錄之後選單才會跟著變
+current_conversation = st.session_state[conversation_key]
+st.session_state[pick_key] = current_conversation if current_conversation in conversation_options else None
+st.selectbox(
+    "💬 對話",
+    conversation_options,
+    format_func=lambda c: conversation_titles.get(c, "➕ 新對話"),
+    key=pick_key,
+    on_change=pick_conversation,
+)
 
-        elif uploaded_file.name.endswith(".pdf"):
-            pdf_reader = PyPDF2.PdfReader(uploaded_file)
-            file_text = "\n".join([page.extract_text() or "" for page in pdf_reader.pages])
+# ========= 顯示對話紀錄 =========
+# 每一輪對話的 HTML 只組一次，存在 session_state 重複使用；預設只顯示最近 HISTORY_PAGE_SIZE 輪
+def turn_html(chat):
+    return user_bubble_html(chat["question"]) + bot_bubble_html(chat["answer"]) + f'''
+            <div style="font-size:13px; color:#666; text-align:right; margin-bottom:20px;">
+                {chat["meta"]}
+            </div>'''
+
+
+render_started = time.perf_counter()
+history = st.session_state[chat_key]
+html_cache = st.session_state.setdefault(f"chat_html_{username}", [])
+if len(html_cache) > len(history):
+    # 紀錄被清除過，快取的 HTML 也不能用了
+    html_cache.clear()
+for chat in history[len(html_cache):]:
+    html_cache.append(turn_html(chat))
+
+offset = st.session_state[offset_key]
+first_visible = max(0, len(history) - st.session_state[visible_key])
+if first_visible + offset > 0:
+    if st.button(f"⬆️ 載入更早的對話（還有 {first_visible + offset} 輪）"):
+        st.session_state[visible_key] += HISTORY_PAGE_SIZE
+        missing = min(offset, st.session_state[visible_key] - len(history))
+        if missing > 0:
+            # session 裡的都顯示了，從存檔往前補；補進來的在最前面，摘要涵蓋的位置跟著往後移
+            older = conversations.load_range(st.session_state[conversation_key], offset - missing, offset)
+            history[:0] = older
+            html_cache[:0] = [turn_html(chat) for chat in older]
+            st.session_state[offset_key] -= missing
+            st.session_state[memory_key]["summarized_upto"] += missing
+        st.rerun()
 
-        elif uploaded_file.name.endswith(".docx"):
-            doc = docx.Document(uploaded_file)
-            file_text = "\n".join([para.text for para in doc.paragraphs])
+with st.container():
+    for chat, html in zip(history[first_visible:], html_cache[first_visible:]):
+        st.markdown(html, unsafe_allow_html=True)
+        if chat.get("sources"):
+            with st.expander(f"📚 參考了 {len(chat['sources'])} 段檔案內容"):
+                for source in chat["sources"]:
+                    st.caption(f"{source['doc']} 段落 {source['chunk']}" if source.get("doc") else f"段落 {source['chunk']}")
+                    st.text(source["text"])
+        st.markdown('<hr style="border: none; border-top: 1px dashed #ccc; margin: 15px 0;">', unsafe_allow_html=True)
+telemetry.observe("render_history", time.perf_counter() - render_started, username)
 
-        elif uploaded_file.name.endswith((".xls", ".xlsx")):
-            # 讀 Excel
-            try:
-                df = pd.read_excel(uploaded_file)
-                # 把整個 Excel 內容轉成純文字，可以用 to_string()
-                file_text = df.to_string(index=False)
-            except Exception as e:
-                st.error(f"❌ Excel 讀取失敗：{e}")
-                file_text = None
-        elif uploaded_file.name.lower().endswith((".png", ".jpg", ".jpeg", ".bmp", ".tiff")):
-            # 讀取圖片並用 pytesseract 辨識
-            try:
-                image = Image.open(uploaded_file)
-                file_text = pytesseract.image_to_string(image, lang='eng+chi_tra')  # 如果你要中文，可以改成 'chi_tra' 需安裝中文字庫
-            except Exception as e:
-                st.error(f"❌ 讀取圖片 OCR 失敗：{e}")
-                file_text = None
 
+# ==== 初始化記憶檔案內容用的 session_state ====
+# 全文和索引放在共用的 doc_store，session 裡只留 DocHandle（檔名 + 內容 hash）；勾選中的文件才會拿來回答問題
+if "uploaded_docs" not in st.session_state:
+    st.session_state.uploaded_docs = []
+    st.session_state.active_doc_keys = set()
+
+
+def active_docs():
+    return [doc for doc in st.session_state.uploaded_docs if doc.key in st.session_state.active_doc_keys]
+
+
+def add_docs(handles):
+    # 同一份檔案重複上傳就換成新的 handle，不會出現兩次
+    for handle in handles:
+        docs = st.session_state.uploaded_docs
+        st.session_state.uploaded_docs = [d for d in docs if d.key != handle.key] + [handle]
+        st.session_state.active_doc_keys.add(handle.key)
+        # 直接改勾選框的狀態，之前取消勾選的檔案重新上傳才會再勾起來
+        st.session_state[f"doc_on_{handle.key}"] = True
+
+
+def toggle_doc(key):
+    # 照勾選框現在的狀態設定，不用「切換」，兩邊才不會錯開
+    if st.session_state[f"doc_on_{key}"]:
+        st.session_state.active_doc_keys.add(key)
+    else:
+        st.session_state.active_doc_keys.discard(key)
+
+
+def doc_list():
+    # 已上傳的文件清單，勾選 / 取消決定要不要放進問題的參考內容
+    if not st.session_state.uploaded_docs:
+        return
+    st.caption("📚 已上傳的文件（勾選的才會拿來回答問題）")
+    for doc in st.session_state.uploaded_docs:
+        # 勾選框的狀態以 active_doc_keys 為準；沒畫出來的那次 rerun 狀態會被清掉，再畫時從 active_doc_keys 補回來
+        st.session_state.setdefault(f"doc_on_{doc.key}", doc.key in st.session_state.active_doc_keys)
+        st.checkbox(doc.name, key=f"doc_on_{doc.key}", on_change=toggle_doc, args=(doc.key,))
+
+
+# ==== 解析上傳檔案 ====
+# 選了檔案就丟進背景的解析 pool，使用者打問題的同時就在解析；還沒解析完的 job 放在 session 裡，
+# 由 ingest_status 這個 fragment 定時輪詢顯示進度，解析完才加進文件清單。
+if "ingest_jobs" not in st.session_state:
+    st.session_state.ingest_jobs = []        # 還沒收尾的 IngestJob
+    st.session_state.ingest_started = set()  # 已經開始解析的上傳檔案（file_id），rerun 時不會重複解析
+    st.session_state.ingest_notices = []     # 解析結果的提示 (層級, 文字)，下一次畫面顯示一次
+    st.session_state.uploader_version = 0    # 清除檔案時換 key，把上傳元件也清空
+
+
+def start_uploads(uploaded_files):
+    for f in uploaded_files or []:
+        if f.file_id not in st.session_state.ingest_started:
+            st.session_state.ingest_started.add(f.file_id)
+            st.session_state.ingest_jobs.append(start_ingest(f.getvalue(), f.name, f.type, tesseract_cmd=st.secrets.get("TESSERACT_CMD")))
+
+
+def show_ingest_progress(jobs, bars):
+    for job, bar in zip(jobs, bars):
+        if job.future.done():
+            bar.progress(1.0, text=f"📄 {job.name} 解析完成")
+        elif job.total:
+            bar.progress(job.progress(), text=f"📄 {job.name} 解析中…（{job.done}/{job.total}）")
+
+
+def collect_ingest():
+    """把解析完的 job 收尾：成功的加進文件清單，錯誤和警告留到 ingest_notices；回傳新加入的文件數。"""
+    finished = [job for job in st.session_state.ingest_jobs if job.future.done()]
+    st.session_state.ingest_jobs = [job for job in st.session_state.ingest_jobs if not job.future.done()]
+    notices = st.session_state.ingest_notices
+    handles = []
+    for job in finished:
+        try:
+            handle = job.future.result()
+        except UnsupportedFormat:
+            telemetry.count("extract_error", 1, username)
+            notices.append(("warning", f"❌ {job.name}：不支援的檔案格式，目前僅支援 {'、'.join('.' + ext for ext in UPLOAD_TYPES)}"))
+            continue
+        except Exception as e:
+            telemetry.count("extract_error", 1, username)
+            notices.append(("error", f"❌ {job.name} 讀取失敗：{e}"))
+            continue
+        # 快取命中時警告也是從快取拿的，例如「只讀了前 500 頁」每次上傳都會提醒
+        for warning in job.result.warnings:
+            notices.append(("warning", f"{job.name}：{warning}"))
+        if job.cached:
+            notices.append(("caption", f"♻️ {job.name} 之前解析過，直接使用解析結果"))
         else:
-            st.warning("❌ 不支援的檔案格式，目前僅支援 .txt、.pdf、.docx")
-            file_text = None
-
-        if file_text:
-            # 記住檔案內容和名稱
-            st.session_state.uploaded_file_text = file_text
-            st.session_state.uploaded_file_name = uploaded_file.name
-            st.info("📖 檔案內容已成功讀取，現在可以根據這份文件問問題")
-
-    # 判斷是要送出單純問題，還是附加檔案的 prompt
-    if user_input:
-        if st.session_state.uploaded_file_text:
-            prompt_with_file = f"以下是使用者的檔案內容：\n\n{st.session_state.uploaded_file_text}\n\n問題：{user_input}"
-            question_desc = f"{user_input}\n（來自上傳檔案：{st.session_state.uploaded_file_name}）"
-        else:
-            prompt_with_file = user_input
-            question_desc = user_input
+            telemetry.observe(f"extract_{job.result.kind}", job.result.seconds, username)
+            notices.append(("caption", f"⏱️ {job.name} 解析耗時 {job.result.seconds} 秒"))
+        if handle is not None:
+            handles.append(handle)
+    if handles:
+        add_docs(handles)
+        notices.append(("info", f"📖 已讀取 {len(handles)} 份檔案，現在可以根據勾選的文件問問題"))
+    return len(handles)
+
+
+def wait_ingest():
+    # 送出時還有檔案在解析：等它解析完（不重新解析），期間照樣顯示進度
+    jobs = list(st.session_state.ingest_jobs)
+    bars = [st.progress(job.progress(), text=f"📄 {job.name} 解析中…") for job in jobs]
+    while not all(job.future.done() for job in jobs):
+        show_ingest_progress(jobs, bars)
+        time.sleep(0.2)
+    for bar in bars:
+        bar.empty()
+    collect_ingest()
+
+
+@st.fragment(run_every=0.5)
+def ingest_status():
+    # 只有還有檔案在解析時才會被呼叫；全部解析完就整頁重跑一次，更新文件清單並停止輪詢
+    jobs = st.session_state.ingest_jobs
+    if all(job.future.done() for job in jobs):
+        collect_ingest()
+        st.rerun()
+    show_ingest_progress(jobs, [st.progress(job.progress(), text=f"📄 {job.name} 解析中…") for job in jobs])
+
+
+def show_ingest_notices():
+    for level, text in st.session_state.ingest_notices:
+        getattr(st, level)(text)
+    st.session_state.ingest_notices = []
+
+
+# ========= 輸入表單和功能按鈕 =========
+# 包在 fragment 裡：按按鈕、勾選項目只會重跑這一塊，不會重畫上面的對話紀錄。
+# 送出問題拿到回答之後才用 st.rerun() 整頁重跑，讓新的一輪出現在紀錄裡。
+@st.fragment
+def chat_controls():
+    # ========= 上傳檔案 =========
+    # 放在表單外面，選了檔案就開始在背景解析，不用等按送出
+    uploaded_files = st.file_uploader(
+        "📁 上傳檔案（可選，可以一次選多個）", type=UPLOAD_TYPES, accept_multiple_files=True,
+        key=f"uploader_{st.session_state.uploader_version}",
+    )
+    start_uploads(uploaded_files)
+    if st.session_state.ingest_jobs:
+        ingest_status()
+
+    # ========= 對話輸入表單 =========
+    with st.form("chat_form", clear_on_submit=True):
+
+        cols = st.columns([6, 2])
+        with cols[0]:
+            user_input = st.text_input("💡 請輸入你的問題：")
+            skip_cache = st.checkbox("🔄 不用快取，重新產生回答")
+            # 管理員可以指定模型，其他人一律自動選
+            model_override = None
+            if username == "ahong":
+                picked = st.selectbox("🤖 模型", ["自動"] + router.models())
+                model_override = None if picked == "自動" else picked
+
+        with cols[1]:
+            submitted = st.form_submit_button("送出")
+    docs_box = st.container()
+
+    clear_clicked = st.button("清除紀錄")
+
+    if submitted:
+        request_started = time.perf_counter()
+        full_prompt = user_input.strip()
+
+        # 還有檔案在背景解析就等它解析完，這段等待才算進 parse
+        if st.session_state.ingest_jobs:
+            with telemetry.span("parse", username):
+                wait_ingest()
+        with docs_box:
+            show_ingest_notices()
+            doc_list()
+
+        # 如果有輸入文字就送出問題
+        if user_input:
+            sync_conversation()
+            docs = active_docs()
+            if docs:
+                question_desc = f"{user_input}\n（來自上傳檔案：{'、'.join(doc.name for doc in docs)}）"
+            else:
+                question_desc = user_input
+
+            # 簡短單純的問題交給便宜又快的模型，附檔案或需要推理的才用大模型（大模型目前太慢時先用小模型）
+            model, route_reason = router.route(
+                user_input, count_tokens(user_input, MODEL), bool(docs), model_override, max_tokens=MAX_COMPLETION_TOKENS
+            )
+
+            # 超出記憶預算的舊對話先摺進摘要（每一輪只會被摘要一次），摘要的花費一樣記進帳本。
+            # 摘要最壞情況的花費超過今日剩餘額度就先不摘要，這一輪只帶最近的對話，不會因為摘要超過上限
+            memory = st.session_state[memory_key]
+            fold_end = recent_start(st.session_state[chat_key], memory, MEMORY_TOKEN_BUDGET, MODEL)
+            summary_cost = 0.0
+            if fold_end > memory["summarized_upto"] and (
+                    remaining is None or fold_cost(memory, st.session_state[chat_key], fold_end, MODEL) <= remaining):
+                try:
+                    summary_tokens = fold_tokens(memory, st.session_state[chat_key], fold_end, MODEL)
+                    with scheduler.slot(username, summary_tokens, priority, timeout=10) as ticket, \
+                            telemetry.span("summary", username):
+                        summary_usage = fold_into_summary(client, memory, st.session_state[chat_key], fold_end)
+                        ticket["used_tokens"] = summary_usage["total_tokens"]
+                    conversations.save_memory(st.session_state[conversation_key], memory, st.session_state[offset_key])
+                    summary_cost = summary_usage["cost_usd"]
+                    usage_ledger.record(
+                        username, summary_cost, total_tokens=summary_usage["total_tokens"], model=SUMMARY_MODEL,
+                        prompt_tokens=summary_usage["prompt_tokens"], completion_tokens=summary_usage["completion_tokens"],
+                        kind="summary", day=today,
+                    )
+                except (OpenAIError, QueueTimeout):
+                    pass   # 摘要失敗或排不到就先跳過，這一輪只帶最近的對話，下一輪再試
+
+            budget = None if remaining is None else remaining - summary_cost
+            plan = plan_request(user_input, budget, model)
+            if plan is not None and model_override is None and router.needs_long_context(model, count_tokens(plan[0], model)):
+                model, route_reason = router.strong_model, "內容較長"
+                plan = plan_request(user_input, budget, model)
+            if model_override is None and model != router.fast_model and (plan is None or plan[3] < MAX_COMPLETION_TOKENS):
+                # 大模型在剩餘額度內只能回很短（或根本付不起），小模型付得起就改用小模型
+                cheaper = plan_request(user_input, budget, router.fast_model)
+                if cheaper is not None and (plan is None or cheaper[3] > plan[3]):
+                    model, route_reason, plan = router.fast_model, "今日額度不多", cheaper
+
+            # 同一份檔案問過一樣的問題就直接沿用之前的回答，不呼叫 API、不計費。
+            # 等模型決定好（包括改用大模型、額度不夠改用小模型）才查，key 跟存進去時用的是同一個模型；
+            # 摘要也摺好了，對話記憶的 hash 就是這次真的會送出去的內容
+            use_cache = not skip_cache and username not in ANSWER_CACHE_DISABLED_USERS
+            # 前面聊過的內容也會影響回答，所以對話記憶的 hash 也算進 key，不同對話（不同使用者）不會拿到彼此的回答
+            context_hash = memory_digest(st.session_state[memory_key], st.session_state[chat_key], MEMORY_TOKEN_BUDGET, MODEL)
+            answer_key = make_answer_key(
+                model, SYSTEM_PROMPT, user_input, "+".join(sorted(doc.key for doc in docs)), context_hash
+            )
+            cached = answer_cache.get(answer_key) if use_cache else None
+            if use_cache:
+                telemetry.count("answer_cache_hit" if cached is not None else "answer_cache_miss", 1, username)
+            if cached is not None:
+                answer, extra = cached
+                add_turn({
+                    "question": question_desc,
+                    "answer": answer,
+                    "meta": f"⚡ 快取命中：沿用之前相同問題的回答（{model}）    💵 費用：$0 美元"
+                            + (f"    🧠 對話摘要：${summary_cost:.6f} 美元" if summary_cost else ""),
+                    "sources": (extra or {}).get("sources", []),
+                    "cached": True,
+                })
+                usage_ledger.record(username, 0.0, model=model, kind="cache", day=today)
+                telemetry.observe("request", time.perf_counter() - request_started, username)
+                st.rerun()
 
-        answer, tokens, usd_cost, twd_cost = ask_openai(prompt_with_file)
+            if plan is None:
+                min_cost = worst_case_cost(model, count_message_tokens(build_messages(user_input), model), MIN_COMPLETION_TOKENS)
+                st.error(f"🚫 這個問題預估至少要 ${min_cost}，超過今日剩餘額度 ${remaining}，請縮短問題或明天再來。")
+                st.stop()
+            prompt_with_file, used_chunks, prompt_tokens, max_tokens = plan
+            if max_tokens < MAX_COMPLETION_TOKENS:
+                st.info(f"✂️ 為了不超過今日額度，這次回答最多 {max_tokens} 個 token")
+
+            # 先把這一輪的問題畫出來，回答用串流逐字填進機器人對話框
+            st.markdown(user_bubble_html(question_desc), unsafe_allow_html=True)
+            # 經過全域排程器再送出：請求數、token 數超過帳號的每分鐘上限時先排隊，不要一起撞 429
+            queue_box = st.empty()
+            try:
+                with scheduler.slot(username, prompt_tokens + max_tokens, priority, on_wait=queue_notice(queue_box)) as ticket:
+                    queue_box.empty()
+                    telemetry.observe("queue_wait", ticket["waited"], username)
+                    answer, tokens, usd_cost, twd_cost = ask_openai(prompt_with_file, placeholder=st.empty(), max_tokens=max_tokens, model=model)
+                    ticket["used_tokens"] = tokens["total_tokens"]
+            except QueueTimeout:
+                queue_box.empty()
+                telemetry.count("queue_timeout", 1, username)
+                st.error("🚦 目前使用的人太多，排隊逾時了，請稍後再試一次。")
+                st.stop()
+
+            sources = [{"doc": docs[d].name, "chunk": i + 1, "text": docs[d].index().chunks[i]} for d, i in used_chunks]
+            add_turn({
+                "question": question_desc,
+                "answer": answer,
+                "meta": f"🤖 {model}（{route_reason}）    🧾 使用 Token 數：{tokens['total_tokens']}    💵 估算費用：${usd_cost} 美元（約 NT${twd_cost}）"
+                        + (f"    🧠 對話摘要：${summary_cost:.6f} 美元" if summary_cost else ""),
+                "sources": sources,
+            })
+            # API 錯誤的回答不進快取；使用者選擇不用快取時，新的回答還是會更新進去
+            if tokens["total_tokens"] and username not in ANSWER_CACHE_DISABLED_USERS:
+                answer_cache.put(answer_key, answer, {"sources": sources})
+            usage_ledger.record(
+                username, usd_cost, total_tokens=tokens["total_tokens"], model=model,
+                prompt_tokens=tokens["prompt_tokens"], completion_tokens=tokens["completion_tokens"], day=today,
+            )
+            telemetry.observe("request", time.perf_counter() - request_started, username, ok=bool(tokens["total_tokens"]))
+            st.rerun()
 
-        st.session_state[chat_key].append({
-            "question": question_desc,
-            "answer": answer,
-            "meta": f"🧾 使用 Token 數：{tokens}    💵 估算費用：${usd_cost} 美元（約 NT${twd_cost}）"
-        })
-        st.session_state.daily_usage[today] = st.session_state.daily_usage.get(today, 0.0) + usd_cost
-        st.rerun()
+    if not submitted:
+        with docs_box:
+            show_ingest_notices()
+            doc_list()
+
+    # ========= 清除功能 =========
+    if clear_clicked:
+        st.session_state.confirm_clear = True
+
+    if st.session_state.confirm_clear:
+        st.warning("⚠️ 你確定要刪除這個對話的所有紀錄嗎？存檔也會一起刪掉，這個動作無法還原！")
+        c1, c2 = st.columns(2)
+        with c1:
+            if st.button("✅ 是的，清除"):
+                # 連同存檔一起刪掉，之後換成一個新對話
+                if st.session_state[conversation_key] is not None:
+                    conversations.delete(st.session_state[conversation_key], username)
+                open_conversation(None)
+                st.session_state.confirm_clear = False
+                # 清除上傳檔案相關資訊
+                st.session_state.uploaded_docs = []   # 沒有 session 參照的文件會從 doc_store 清掉
+                st.session_state.active_doc_keys = set()
+                st.session_state.ingest_jobs = []
+                st.session_state.ingest_started = set()
+                st.session_state.uploader_version += 1
+                st.rerun()
+        with c2:
+            if st.button("❌ 取消"):
+                st.session_state.confirm_clear = False
 
 
-# ========= 清除功能 =========
-if clear_clicked:
-    st.session_state.confirm_clear = True
-
-if st.session_state.confirm_clear:
-    st.warning("⚠️ 你確定要清除所有對話紀錄嗎？這個動作無法還原！")
-    c1, c2 = st.columns(2)
-    with c1:
-        if st.button("✅ 是的，清除"):
-            st.session_state[chat_key] = []
-            st.session_state.confirm_clear = False
-            # 清除上傳檔案相關資訊
-            st.session_state.uploaded_file_text = None
-            st.session_state.uploaded_file_name = None
-            st.rerun()
-    with c2:
-        if st.button("❌ 取消"):
-            st.session_state.confirm_clear = False
+chat_controls()
 
 # ========= 使用記錄 =========
 with st.expander("📊 每日使用紀錄"):
-    for date_str, cost in sorted(st.session_state.daily_usage.items()):
+    for date_str, cost in usage_ledger.daily_totals(username):
         st.write(f"{date_str}：${round(cost, 4)}")
+    if username == "ahong":
+        st.markdown("**今日各使用者花費**")
+        for user, cost, tokens_sum, calls in usage_ledger.user_totals(today):
+            st.write(f"{user}：${round(cost, 4)}（{calls} 次，{tokens_sum} tokens）")
+        stats_now = api_stats.snapshot()
+        st.caption(f"🌐 API：呼叫 {stats_now['calls']} 次，重試 {stats_now['retries']} 次，失敗 {stats_now['failures']} 次，"
+                   f"延遲 p50 {stats_now['p50_s']} 秒 / p95 {stats_now['p95_s']} 秒")
+        st.caption("🤖 模型延遲（第一個 token 秒數 / 每秒 token）：" + "、".join(
+            f"{m} {ttft}s / {rate}" for m, (ttft, rate) in router.latency_table().items()))
+        queue_stats = scheduler.snapshot()
+        st.caption(f"🚦 排程：排隊 {queue_stats['queued']} 個，執行中 {queue_stats['running']} 個，"
+                   f"已放行 {queue_stats['served']} 個，逾時 {queue_stats['timeouts']} 個；"
+                   f"這分鐘還剩 {queue_stats['requests_left']} 次請求 / {queue_stats['tokens_left']} tokens")
+        store_stats = doc_store.stats()
+        st.caption(f"🗂️ 文件存放區：{store_stats['docs']} 份（記憶體 {store_stats['in_memory']} 份，"
+                   f"{round(store_stats['bytes'] / 1024 / 1024, 1)} MB），{store_stats['sessions']} 個 session 參照，"
+                   f"寫到磁碟 {store_stats['spills']} 次，清掉 {store_stats['evictions']} 份")
+        cache_stats = parse_cache.stats()
+        st.caption(f"📦 檔案解析快取：命中 {cache_stats['hits'] + cache_stats['disk_hits']} 次，未命中 {cache_stats['misses']} 次，"
+                   f"快取 {cache_stats['entries']} 份（{round(cache_stats['bytes'] / 1024 / 1024, 1)} MB）")
+
+# ========= 效能指標（管理員） =========
+# 打開才查詢，平常不拖慢 rerun
+if username == "ahong" and st.toggle("📈 效能指標"):
+    render_metrics_dashboard(telemetry)
 
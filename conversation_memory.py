@@ -0,0 +1,109 @@
+import hashlib
+import json
+
+from openai_client import call_with_retry
+from pricing import cost_usd, count_tokens
+
+# 多輪對話記憶：最近幾輪對話原封不動放進 messages（在 token 預算內），
+# 放不下的舊對話摺疊進一段「先前對話摘要」。摘要是增量更新的：每一輪只會被摘要一次，
+# 之後只把新掉出預算的幾輪和舊摘要合併，不會每次都從頭重算。
+
+MEMORY_TOKEN_BUDGET = 1500   # 最近幾輪原文最多佔多少 token
+SUMMARY_MODEL = "gpt-4o-mini"
+SUMMARY_MAX_TOKENS = 300
+SUMMARY_SYSTEM_PROMPT = "你負責把對話整理成精簡的繁體中文摘要，保留使用者提過的事實、偏好、問題和助理的結論，不要加入新資訊。"
+
+
+def new_memory():
+    # summarized_upto：history 裡前幾輪已經摺進摘要了
+    return {"summary": "", "summarized_upto": 0}
+
+
+def _usable(turn):
+    # API 錯誤的回合沒有參考價值，不放進記憶
+    return not turn["answer"].startswith("❌")
+
+
+def _turn_tokens(turn, model):
+    # 算過就記在這一輪上，每次 rerun 不用重算整段歷史
+    if "memory_tokens" not in turn:
+        turn["memory_tokens"] = count_tokens(turn["question"], model) + count_tokens(turn["answer"], model) + 6
+    return turn["memory_tokens"]
+
+
+def recent_start(history, memory, budget=MEMORY_TOKEN_BUDGET, model="gpt-4o"):
+    """從最後一輪往前算，在 budget 內能原文保留的第一輪是第幾輪（不會早於已摘要的範圍）。"""
+    used = 0
+    start = len(history)
+    while start > memory["summarized_upto"]:
+        turn = history[start - 1]
+        cost = _turn_tokens(turn, model) if _usable(turn) else 0
+        if used + cost > budget:
+            break
+        used += cost
+        start -= 1
+    return start
+
+
+def fold_tokens(memory, history, end, model="gpt-4o"):
+    """fold_into_summary 這次最多會用掉多少 token（排程預留用）。"""
+    turns = [t for t in history[memory["summarized_upto"]:end] if _usable(t)]
+    if not turns:
+        return 0
+    return sum(_turn_tokens(t, model) for t in turns) + count_tokens(memory["summary"], model) + SUMMARY_MAX_TOKENS + 100
+
+
+def fold_cost(memory, history, end, model="gpt-4o"):
+    """fold_into_summary 這次最多會花多少錢（摘要用滿 SUMMARY_MAX_TOKENS）。"""
+    tokens = fold_tokens(memory, history, end, model)
+    if not tokens:
+        return 0.0
+    return cost_usd(SUMMARY_MODEL, tokens - SUMMARY_MAX_TOKENS, SUMMARY_MAX_TOKENS)
+
+
+def fold_into_summary(client, memory, history, end, model=SUMMARY_MODEL):
+    """把 history[summarized_upto:end] 跟舊摘要合併成新摘要，回傳這次摘要的 token 用量和花費。"""
+    turns = [t for t in history[memory["summarized_upto"]:end] if _usable(t)]
+    usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cost_usd": 0.0}
+    if turns:
+        transcript = "\n".join(f"使用者：{t['question']}\n助理：{t['answer']}" for t in turns)
+        prompt = f"先前的摘要：\n{memory['summary'] or '（無）'}\n\n新增的對話：\n{transcript}\n\n請輸出合併後的新摘要。"
+        response = call_with_retry(
+            client.chat.completions.create,
+            model=model,
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.2,
+            max_tokens=SUMMARY_MAX_TOKENS,
+        )
+        memory["summary"] = response.choices[0].message.content.strip()
+        usage = {
+            "prompt_tokens": response.usage.prompt_tokens,
+            "completion_tokens": response.usage.completion_tokens,
+            "total_tokens": response.usage.total_tokens,
+            "cost_usd": cost_usd(model, response.usage.prompt_tokens, response.usage.completion_tokens),
+        }
+    memory["summarized_upto"] = end
+    return usage
+
+
+def memory_messages(system_prompt, memory, history, prompt, budget=MEMORY_TOKEN_BUDGET, model="gpt-4o"):
+    messages = [{"role": "system", "content": system_prompt}]
+    if memory["summary"]:
+        messages.append({"role": "system", "content": f"先前對話摘要：\n{memory['summary']}"})
+    for turn in history[recent_start(history, memory, budget, model):]:
+        if _usable(turn):
+            messages.append({"role": "user", "content": turn["question"]})
+            messages.append({"role": "assistant", "content": turn["answer"]})
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+
+def memory_digest(memory, history, budget=MEMORY_TOKEN_BUDGET, model="gpt-4o"):
+    """這次會帶進 messages 的摘要和最近幾輪原文的 hash（回答快取用）；沒有任何對話記憶時回傳空字串。"""
+    context = memory_messages("", memory, history, "", budget, model)[1:-1]
+    if not context:
+        return ""
+    return hashlib.sha256(json.dumps(context, ensure_ascii=False).encode("utf-8")).hexdigest()
@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+
+from sqlite_db import get_db
+
+# 對話紀錄存檔：每個使用者可以有好幾個對話，每一輪問答 append 一筆，登出、重新整理、重啟之後都還在。
+# 存在 SQLite（WAL 模式），(conversation_id, seq) 有索引，append 和讀最後幾輪都不用掃整個對話。
+# session 裡只放最近幾輪（load_recent），更早的要看時再用 load_range 往前補。
+# 對話記憶的摘要也一起存：summarized_upto 在資料庫裡是「整個對話的第幾輪」，
+# 讀出來時換算成相對於 session 裡第一輪的位置，跟 conversation_memory 的用法一致。
+
+CONVERSATION_DB = os.environ.get("CONVERSATION_DB", "conversations.db")
+LOAD_RECENT_TURNS = 20     # 登入、切換對話時先載入最近幾輪
+TITLE_CHARS = 30           # 對話標題取第一個問題的前幾個字
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    title TEXT NOT NULL DEFAULT '',
+    created REAL NOT NULL,
+    updated REAL NOT NULL,
+    turns INTEGER NOT NULL DEFAULT 0,
+    summary TEXT NOT NULL DEFAULT '',
+    summarized_upto INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations (username, updated);
+CREATE TABLE IF NOT EXISTS turns (
+    conversation_id INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    question TEXT NOT NULL,
+    answer TEXT NOT NULL,
+    meta TEXT NOT NULL DEFAULT '',
+    sources TEXT,
+    cached INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (conversation_id, seq)
+);
+"""
+
+
+def _turn(row):
+    question, answer, meta, sources, cached = row
+    turn = {"question": question, "answer": answer, "meta": meta, "sources": json.loads(sources) if sources else []}
+    if cached:
+        turn["cached"] = True
+    return turn
+
+
+class ConversationStore:
+    def __init__(self, path=CONVERSATION_DB):
+        self.path = path
+        self._db = get_db(path)
+        with self._db.transaction() as conn:
+            conn.executescript(_SCHEMA)
+
+    def create(self, username):
+        now = time.time()
+        with self._db.transaction() as conn:
+            cur = conn.execute("INSERT INTO conversations (username, created, updated) VALUES (?, ?, ?)", (username, now, now))
+            return cur.lastrowid
+
+    def list_conversations(self, username, limit=50):
+        """最近用過的對話，新的在前：[{"id", "title", "updated", "turns"}]。"""
+        rows = self._db.query(
+            "SELECT id, title, updated, turns FROM conversations WHERE username = ? ORDER BY updated DESC LIMIT ?",
+            (username, limit),
+        )
+        return [{"id": r[0], "title": r[1], "updated": r[2], "turns": r[3]} for r in rows]
+
+    def latest(self, username):
+        rows = self.list_conversations(username, limit=1)
+        return rows[0]["id"] if rows else None
+
+    def append(self, conversation_id, turn):
+        """把一輪問答接在對話最後面，回傳它是第幾輪（從 0 算）。"""
+        now = time.time()
+        with self._db.transaction() as conn:   # with 區塊結束自動 commit；UPDATE 先拿到寫入鎖，seq 不會跟別的 session 撞號
+            conn.execute(
+                "UPDATE conversations SET turns = turns + 1, updated = ?, "
+                "title = CASE WHEN title = '' THEN ? ELSE title END WHERE id = ?",
+                (now, turn["question"].splitlines()[0][:TITLE_CHARS] if turn["question"] else "", conversation_id),
+            )
+            seq = conn.execute("SELECT turns - 1 FROM conversations WHERE id = ?", (conversation_id,)).fetchone()[0]
+            conn.execute(
+                "INSERT INTO turns (conversation_id, seq, ts, question, answer, meta, sources, cached) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (conversation_id, seq, now, turn["question"], turn["answer"], turn.get("meta", ""),
+                 json.dumps(turn.get("sources") or [], ensure_ascii=False), int(bool(turn.get("cached")))),
+            )
+        return seq
+
+    def turn_count(self, conversation_id):
+        rows = self._db.query("SELECT turns FROM conversations WHERE id = ?", (conversation_id,))
+        return rows[0][0] if rows else 0
+
+    def load_range(self, conversation_id, start, end):
+        """第 start 到 end-1 輪。"""
+        rows = self._db.query(
+            "SELECT question, answer, meta, sources, cached FROM turns WHERE conversation_id = ? AND seq >= ? AND seq < ? ORDER BY seq",
+            (conversation_id, start, end),
+        )
+        return [_turn(r) for r in rows]
+
+    def load_recent(self, conversation_id, n=LOAD_RECENT_TURNS):
+        """回傳 (offset, 最近的幾輪, 對話記憶)；offset 是載入的第一輪在整個對話裡是第幾輪。
+
+        至少會從摘要涵蓋到的地方開始載入，還沒摘要的對話不會因為沒載入而從記憶裡消失。
+        """
+        rows = self._db.query(
+            "SELECT turns, summary, summarized_upto FROM conversations WHERE id = ?", (conversation_id,)
+        )
+        if not rows:
+            return 0, [], {"summary": "", "summarized_upto": 0}
+        total, summary, summarized_upto = rows[0]
+        offset = max(0, min(total - n, summarized_upto))
+        memory = {"summary": summary, "summarized_upto": summarized_upto - offset}
+        return offset, self.load_range(conversation_id, offset, total), memory
+
+    def save_memory(self, conversation_id, memory, offset):
+        # 摘要只會往後推：別的 session 已經摘要到更後面的話就不蓋掉
+        with self._db.transaction() as conn:
+            conn.execute(
+                "UPDATE conversations SET summary = ?, summarized_upto = ? WHERE id = ? AND summarized_upto <= ?",
+                (memory["summary"], memory["summarized_upto"] + offset, conversation_id, memory["summarized_upto"] + offset),
+            )
+
+    def delete(self, conversation_id, username):
+        """真的把對話和裡面每一輪從資料庫刪掉（只刪得到自己的對話）。"""
+        with self._db.transaction() as conn:
+            cur = conn.execute("DELETE FROM conversations WHERE id = ? AND username = ?", (conversation_id, username))
+            if cur.rowcount:
+                conn.execute("DELETE FROM turns WHERE conversation_id = ?", (conversation_id,))
+            return cur.rowcount > 0
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_conversation_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ConversationStore()
+        return _store
@@ -0,0 +1,157 @@
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import weakref
+from collections import OrderedDict
+
+from retrieval import RetrievalIndex
+
+# 上傳文件的共用存放區：session_state 只放一個小小的 DocHandle，全文和檢索索引放在這裡，整個 process 共用。
+# - 以內容 hash 當 key，不同 session 上傳同一份檔案只存一份
+# - 記憶體總量超過 DOC_STORE_MAX_BYTES 時，把最久沒用到的文件全文寫到磁碟、索引丟掉，下次用到再讀回來重建
+# - 沒有任何 DocHandle 指向的文件（session 結束、清除或換了檔案）直接刪掉，記憶體和磁碟都不留
+
+DOC_STORE_MAX_BYTES = int(os.environ.get("DOC_STORE_MAX_BYTES", 256 * 1024 * 1024))
+DOC_STORE_DIR = os.environ.get("DOC_STORE_DIR") or os.path.join(tempfile.gettempdir(), "chatai-docs")
+
+
+class DocHandle:
+    """放在 session_state 裡的文件參照；session 不再持有它（被回收）時，文件就可以被清掉。"""
+
+    def __init__(self, store, key, name):
+        self._store = store
+        self.key = key
+        self.name = name
+
+    def text(self):
+        return self._store.text(self.key)
+
+    def index(self):
+        return self._store.index(self.key)
+
+    def __repr__(self):
+        return f"DocHandle({self.name!r}, {self.key[:12]})"
+
+
+class DocStore:
+    def __init__(self, max_bytes=DOC_STORE_MAX_BYTES, spill_dir=DOC_STORE_DIR):
+        self.max_bytes = max_bytes
+        # 每個 process 用自己的子資料夾，多個 worker 不會刪到彼此的檔案；結束時整個清掉
+        self.spill_dir = os.path.join(spill_dir, str(os.getpid()))
+        atexit.register(shutil.rmtree, self.spill_dir, True)
+        self._lock = threading.RLock()
+        self._docs = OrderedDict()   # key -> {"text", "index", "bytes", "spilled"}，越後面越近期用到
+        self._handles = {}           # key -> WeakSet(DocHandle)
+        self._bytes = 0
+        self.spills = 0
+        self.evictions = 0
+
+    def _path(self, key):
+        return os.path.join(self.spill_dir, key + ".txt")
+
+    def put(self, key, text, name=None):
+        """存一份文件（同 key 已經有了就共用），回傳給 session 保存的 DocHandle。"""
+        with self._lock:
+            doc = self._docs.get(key)
+            if doc is None:
+                doc = {"text": text, "index": None, "bytes": sys.getsizeof(text), "spilled": False}
+                self._docs[key] = doc
+                self._bytes += doc["bytes"]
+                self._handles[key] = weakref.WeakSet()
+            handle = DocHandle(self, key, name or key)
+            self._handles[key].add(handle)
+            self._docs.move_to_end(key)
+        self._maintain(keep=key)
+        return handle
+
+    def _load(self, key):
+        # 呼叫前要拿著 lock；被寫到磁碟的文件讀回記憶體
+        doc = self._docs[key]
+        if doc["text"] is None:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                doc["text"] = f.read()
+            doc["bytes"] = sys.getsizeof(doc["text"])
+            self._bytes += doc["bytes"]
+        self._docs.move_to_end(key)
+        return doc
+
+    def text(self, key):
+        with self._lock:
+            text = self._load(key)["text"]
+        self._maintain(keep=key)
+        return text
+
+    def index(self, key):
+        """文件的檢索索引，第一次用到（或被擠到磁碟之後）才建。"""
+        with self._lock:
+            doc = self._load(key)
+            index = doc["index"]
+            text = doc["text"]
+        if index is None:
+            index = RetrievalIndex(text)
+            size = index.nbytes()
+            with self._lock:
+                doc = self._docs.get(key)
+                if doc is not None and doc["index"] is None and doc["text"] is not None:
+                    doc["index"] = index
+                    doc["bytes"] += size
+                    self._bytes += size
+            self._maintain(keep=key)
+        return index
+
+    def _maintain(self, keep=None):
+        """刪掉沒人參照的文件；記憶體還是超過上限，就把最久沒用到的寫到磁碟。keep 是正在用的那份，不動它。"""
+        with self._lock:
+            for key in [k for k, handles in self._handles.items() if not handles and k != keep]:
+                doc = self._docs.pop(key)
+                del self._handles[key]
+                self._bytes -= doc["bytes"]
+                if doc["spilled"]:
+                    try:
+                        os.remove(self._path(key))
+                    except OSError:
+                        pass
+                self.evictions += 1
+            for key in list(self._docs):
+                if self._bytes <= self.max_bytes:
+                    break
+                doc = self._docs[key]
+                if key == keep or doc["text"] is None:
+                    continue
+                if not doc["spilled"]:
+                    os.makedirs(self.spill_dir, exist_ok=True)
+                    tmp = self._path(key) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+                    with open(tmp, "w", encoding="utf-8") as f:
+                        f.write(doc["text"])
+                    os.replace(tmp, self._path(key))
+                    doc["spilled"] = True
+                self._bytes -= doc["bytes"]
+                doc.update(text=None, index=None, bytes=0)
+                self.spills += 1
+
+    def stats(self):
+        with self._lock:
+            self._maintain()
+            return {
+                "docs": len(self._docs),
+                "in_memory": sum(1 for d in self._docs.values() if d["text"] is not None),
+                "bytes": self._bytes,
+                "sessions": sum(len(h) for h in self._handles.values()),
+                "spills": self.spills,
+                "evictions": self.evictions,
+            }
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_doc_store():
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = DocStore()
+        return _store
@@ -0,0 +1,201 @@
+import csv
+import datetime
+import os
+import random
+from collections import Counter
+from io import BytesIO, StringIO
+
+# Excel 解析：用 openpyxl 的 read_only 模式一列一列讀，不會把整張表載進 DataFrame。
+# 每張工作表輸出精簡的摘要：欄位型態、統計值、常見值，再加上開頭幾列和隨機抽樣的幾列（CSV 格式），
+# 比 df.to_string() 那種補滿空白的表格省很多 token。
+
+EXCEL_MAX_ROWS = int(os.environ.get("EXCEL_MAX_ROWS", 200_000))      # 整本活頁簿最多掃幾列
+EXCEL_MAX_BYTES = int(os.environ.get("EXCEL_MAX_BYTES", 60_000))     # 輸出文字的上限
+HEAD_ROWS = 20
+SAMPLE_ROWS = 30
+TOP_VALUES = 5
+MAX_CELL_CHARS = 80
+
+
+def _type_name(value):
+    if isinstance(value, bool):
+        return "布林"
+    if isinstance(value, (int, float)):
+        return "數值"
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return "日期"
+    return "文字"
+
+
+def _cell_text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    elif isinstance(value, datetime.datetime) and value.time() == datetime.time():
+        value = value.date()
+    text = str(value).replace("\n", " ").strip()
+    return text[:MAX_CELL_CHARS]
+
+
+class _ColumnStats:
+    def __init__(self, name):
+        self.name = name
+        self.non_null = 0
+        self.types = Counter()
+        self.min = None
+        self.max = None
+        self.total = 0.0
+        self.numeric = 0
+        self.values = Counter()
+
+    def add(self, value):
+        if value is None or value == "":
+            return
+        self.non_null += 1
+        kind = _type_name(value)
+        self.types[kind] += 1
+        if kind == "數值":
+            self.numeric += 1
+            self.total += value
+        if kind in ("數值", "日期"):
+            try:
+                self.min = value if self.min is None or value < self.min else self.min
+                self.max = value if self.max is None or value > self.max else self.max
+            except TypeError:
+                pass
+        else:
+            key = _cell_text(value)
+            # 只記前 1000 種不同值，避免高基數欄位吃光記憶體
+            if len(self.values) < 1000 or key in self.values:
+                self.values[key] += 1
+
+    def describe(self, rows):
+        if not self.types:
+            return f"- {self.name}（空白）"
+        kind = self.types.most_common(1)[0][0]
+        parts = [f"非空 {self.non_null}/{rows}"]
+        if kind == "數值" and self.numeric:
+            parts.append(f"最小 {_cell_text(self.min)}，最大 {_cell_text(self.max)}，平均 {round(self.total / self.numeric, 4)}")
+        elif kind == "日期" and self.min is not None:
+            parts.append(f"範圍 {_cell_text(self.min)} ~ {_cell_text(self.max)}")
+        elif self.values:
+            common = "、".join(f"{v}({c})" for v, c in self.values.most_common(TOP_VALUES))
+            parts.append(f"不同值 {len(self.values)}{'+' if len(self.values) >= 1000 else ''} 種，常見：{common}")
+        return f"- {self.name}（{kind}）：" + "，".join(parts)
+
+
+def summarize_sheet(name, rows, max_rows=EXCEL_MAX_ROWS, row_filter=None, seed=0):
+    """rows 是逐列的 tuple iterator，第一個非空列當作標題。回傳 (摘要文字, 實際掃過的列數, 是否達到列數上限)。
+
+    row_filter(values) 有給的話只挑符合條件的列當樣本；沒給就用開頭幾列 + 蓄水池抽樣。
+    """
+    header = None
+    columns = []
+    head = []
+    sample = []
+    rng = random.Random(seed)   # 固定種子，同一份檔案每次抽到的列都一樣，快取才有意義
+    scanned = 0
+    truncated = False
+    for values in rows:
+        if header is None:
+            if not any(v not in (None, "") for v in values):
+                continue
+            header = [_cell_text(v) or f"欄{i + 1}" for i, v in enumerate(values)]
+            columns = [_ColumnStats(h) for h in header]
+            continue
+        if not any(v not in (None, "") for v in values):
+            continue
+        if scanned >= max_rows:
+            truncated = True
+            break
+        scanned += 1
+        for col, value in zip(columns, values):
+            col.add(value)
+        row = (scanned, values[:len(header)])
+        if row_filter is not None:
+            if row_filter(values) and len(sample) < HEAD_ROWS + SAMPLE_ROWS:
+                sample.append(row)
+        elif len(head) < HEAD_ROWS:
+            head.append(row)
+        elif len(sample) < SAMPLE_ROWS:
+            sample.append(row)
+        else:
+            j = rng.randrange(scanned - HEAD_ROWS)
+            if j < SAMPLE_ROWS:
+                sample[j] = row
+
+    if header is None:
+        return f"## 工作表：{name}（空白）", 0, False
+
+    lines = [f"## 工作表：{name}（{scanned} 列 × {len(header)} 欄{'，已達列數上限' if truncated else ''}）", "欄位："]
+    lines.extend(col.describe(scanned) for col in columns)
+    picked = sorted(head + sample, key=lambda r: r[0])
+    if picked:
+        if row_filter is not None:
+            lines.append(f"符合條件的資料列（{len(picked)} 列，CSV）：")
+        else:
+            lines.append(f"資料列（前 {len(head)} 列 + 抽樣 {len(sample)} 列，CSV）：")
+        buf = StringIO()
+        writer = csv.writer(buf, lineterminator="\n")
+        writer.writerow(["列號"] + header)
+        for number, values in picked:
+            writer.writerow([number] + [_cell_text(v) for v in values])
+        lines.append(buf.getvalue().rstrip("\n"))
+    return "\n".join(lines), scanned, truncated
+
+
+def _iter_openpyxl_sheets(data):
+    import openpyxl
+    workbook = openpyxl.load_workbook(BytesIO(data), read_only=True, data_only=True)
+    try:
+        for sheet in workbook.worksheets:
+            yield sheet.title, sheet.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+
+def _iter_xls_sheets(data, max_rows):
+    # 舊版 .xls openpyxl 讀不了，只好交給 pandas（xlrd），但還是限制讀取的列數
+    import pandas as pd
+    sheets = pd.read_excel(BytesIO(data), sheet_name=None, header=None, nrows=max_rows + 1)
+    for name, df in sheets.items():
+        df = df.astype(object).where(df.notna(), None)
+        yield str(name), df.itertuples(index=False, name=None)
+
+
+def extract_excel_text(data, filename="", max_rows=EXCEL_MAX_ROWS, max_bytes=EXCEL_MAX_BYTES, row_filter=None):
+    """回傳 (文字, 資訊)。資訊裡有每張工作表掃過的列數、是否因為上限被截斷。"""
+    if filename.lower().endswith(".xls"):
+        sheets = _iter_xls_sheets(data, max_rows)
+    else:
+        sheets = _iter_openpyxl_sheets(data)
+
+    parts = []
+    size = 0
+    remaining_rows = max_rows
+    info = {"sheets": [], "truncated": False}
+    try:
+        for name, rows in sheets:
+            if remaining_rows <= 0:
+                info["truncated"] = True
+                break
+            text, scanned, sheet_truncated = summarize_sheet(name, rows, max_rows=remaining_rows, row_filter=row_filter)
+            remaining_rows -= scanned
+            info["truncated"] = info["truncated"] or sheet_truncated
+            encoded = len(text.encode("utf-8"))
+            if size + encoded > max_bytes:
+                # 超過位元組上限就截斷在完整的一行上
+                room = max_bytes - size
+                text = text.encode("utf-8")[:max(room, 0)].decode("utf-8", errors="ignore").rsplit("\n", 1)[0]
+                if text:
+                    parts.append(text)
+                info["sheets"].append({"name": name, "rows": scanned})
+                info["truncated"] = True
+                break
+            parts.append(text)
+            size += encoded + 2
+            info["sheets"].append({"name": name, "rows": scanned})
+    finally:
+        sheets.close()   # 提早結束時也要關掉活頁簿
+    return "\n\n".join(parts), info
@@ -0,0 +1,215 @@
+import os
+import time
+from dataclasses import dataclass, field
+from io import BytesIO, StringIO
+
+# 檔案解析的外掛註冊表：副檔名 / MIME type → 解析函式。
+# 解析函式自己在函式裡 import 需要的套件（PyPDF2、docx、pandas、PIL…），第一次遇到那種檔案才載入，
+# Streamlit worker 冷啟動時不用先付這些套件的 import 成本。
+# 新增格式只要寫一個 fn(data, filename, on_progress, **options) -> (text, meta)，再用 @register 註冊。
+
+
+@dataclass
+class ExtractResult:
+    text: str
+    kind: str                                    # 用哪個解析器讀的，例如 "pdf"
+    meta: dict = field(default_factory=dict)     # 頁數、工作表、OCR 每頁耗時等
+    warnings: list = field(default_factory=list)
+    truncated: bool = False
+    seconds: float = 0.0
+
+
+class UnsupportedFormat(ValueError):
+    pass
+
+
+_BY_EXTENSION = {}
+_BY_MIME = {}
+
+
+def register(kind, extensions, mime_types=()):
+    """註冊解析器。extensions 含點（".pdf"）；同一個副檔名後註冊的會蓋掉先註冊的。"""
+    def decorator(fn):
+        entry = (kind, fn)
+        for ext in extensions:
+            _BY_EXTENSION[ext.lower()] = entry
+        for mime in mime_types:
+            _BY_MIME[mime] = entry
+        return fn
+    return decorator
+
+
+def find_extractor(filename, mime_type=None):
+    ext = os.path.splitext(filename)[1].lower()
+    return _BY_EXTENSION.get(ext) or _BY_MIME.get(mime_type)
+
+
+def supported_extensions(kinds=None):
+    """給 st.file_uploader(type=...) 用的副檔名清單（不含點）；kinds 有給就只列這幾種解析器的。"""
+    return sorted(ext[1:] for ext, (kind, _) in _BY_EXTENSION.items() if kinds is None or kind in kinds)
+
+
+def extract(data, filename, mime_type=None, on_progress=None, **options):
+    """解析檔案內容，回傳 ExtractResult。不支援的格式丟 UnsupportedFormat，解析失敗的例外原樣往上丟。"""
+    entry = find_extractor(filename, mime_type)
+    if entry is None:
+        raise UnsupportedFormat(f"不支援的檔案格式：{os.path.basename(filename)}")
+    kind, fn = entry
+    started = time.perf_counter()
+    text, meta = fn(data, filename, on_progress, **options)
+    return ExtractResult(
+        text=text or "",
+        kind=kind,
+        meta=meta,
+        warnings=meta.pop("warnings", []),
+        truncated=bool(meta.get("truncated")),
+        seconds=round(time.perf_counter() - started, 3),
+    )
+
+
+def _decode(data):
+    # 大部分是 UTF-8；Windows 存的繁中檔常是 Big5，先試 UTF-8（含 BOM）再退回 Big5
+    for encoding in ("utf-8-sig", "big5"):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError:
+            continue
+    return data.decode("utf-8", errors="ignore")
+
+
+# ========= 內建的解析器 =========
+
+@register("text", [".txt", ".md", ".markdown"], ["text/plain", "text/markdown"])
+def _extract_text(data, filename, on_progress, **options):
+    return _decode(data), {}
+
+
+@register("pdf", [".pdf"], ["application/pdf"])
+def _extract_pdf(data, filename, on_progress, **options):
+    # 逐頁解析，大檔案會分批平行處理
+    from pdf_extract import extract_pdf_text
+    text, info = extract_pdf_text(data, on_page=on_progress)
+    if info["truncated"]:
+        info["warnings"] = [f"⚠️ 檔案太大，只讀取了前 {info['pages_read']} 頁（共 {info['total_pages']} 頁）"]
+    return text, info
+
+
+@register("docx", [".docx"], ["application/vnd.openxmlformats-officedocument.wordprocessingml.document"])
+def _extract_docx(data, filename, on_progress, **options):
+    import docx
+    doc = docx.Document(BytesIO(data))
+    lines = [para.text for para in doc.paragraphs]
+    # 表格的內容不在 paragraphs 裡，另外一列一行接在後面
+    for table in doc.tables:
+        for row in table.rows:
+            lines.append(" | ".join(cell.text.strip() for cell in row.cells))
+    return "\n".join(lines), {"paragraphs": len(doc.paragraphs), "tables": len(doc.tables)}
+
+
+@register("pptx", [".pptx"], ["application/vnd.openxmlformats-officedocument.presentationml.presentation"])
+def _extract_pptx(data, filename, on_progress, **options):
+    try:
+        from pptx import Presentation
+    except ImportError:
+        raise RuntimeError("讀取 .pptx 需要安裝 python-pptx")
+    slides = Presentation(BytesIO(data)).slides
+    parts = []
+    for number, slide in enumerate(slides, 1):
+        lines = [f"## 投影片 {number}"]
+        for shape in slide.shapes:
+            if shape.has_text_frame and shape.text_frame.text.strip():
+                lines.append(shape.text_frame.text.strip())
+        if slide.has_notes_slide and slide.notes_slide.notes_text_frame.text.strip():
+            lines.append("備忘稿：" + slide.notes_slide.notes_text_frame.text.strip())
+        parts.append("\n".join(lines))
+        if on_progress is not None:
+            on_progress(number, len(slides))
+    return "\n\n".join(parts), {"slides": len(slides)}
+
+
+@register("excel", [".xls", ".xlsx"], [
+    "application/vnd.ms-excel", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+])
+def _extract_excel(data, filename, on_progress, **options):
+    # 逐列串流讀取所有工作表，只送欄位摘要和抽樣資料列
+    from excel_extract import extract_excel_text
+    text, info = extract_excel_text(data, filename)
+    if info["truncated"]:
+        info["warnings"] = ["⚠️ 表格太大，只摘要了部分資料列"]
+    return text, info
+
+
+def _csv_value(value):
+    # csv 讀進來都是字串，看起來像數字的轉成數字，欄位統計才算得出範圍
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+@register("csv", [".csv"], ["text/csv"])
+def _extract_csv(data, filename, on_progress, **options):
+    # 跟 Excel 一樣只送欄位摘要和抽樣資料列，大檔案不會整份塞進 prompt
+    import csv
+    from excel_extract import summarize_sheet
+    rows = (tuple(_csv_value(v) for v in row) for row in csv.reader(StringIO(_decode(data))))
+    text, scanned, truncated = summarize_sheet(os.path.basename(filename), rows)
+    info = {"sheets": [{"name": os.path.basename(filename), "rows": scanned}], "truncated": truncated}
+    if truncated:
+        info["warnings"] = ["⚠️ 表格太大，只摘要了部分資料列"]
+    return text, info
+
+
+@register("html", [".html", ".htm"], ["text/html"])
+def _extract_html(data, filename, on_progress, **options):
+    from html.parser import HTMLParser
+
+    class _TextParser(HTMLParser):
+        # 只留看得到的文字，script / style 裡的東西跳過，區塊元素換行
+        BLOCKS = {"p", "div", "br", "li", "tr", "h1", "h2", "h3", "h4", "h5", "h6", "section", "article", "table"}
+
+        def __init__(self):
+            super().__init__()
+            self.parts = []
+            self.skip = 0
+            self.title = ""
+            self._in_title = False
+
+        def handle_starttag(self, tag, attrs):
+            if tag in ("script", "style", "noscript"):
+                self.skip += 1
+            elif tag == "title":
+                self._in_title = True
+            elif tag in self.BLOCKS:
+                self.parts.append("\n")
+
+        def handle_endtag(self, tag):
+            if tag in ("script", "style", "noscript"):
+                self.skip = max(0, self.skip - 1)
+            elif tag == "title":
+                self._in_title = False
+            elif tag in self.BLOCKS:
+                self.parts.append("\n")
+
+        def handle_data(self, text):
+            if self._in_title:
+                self.title += text
+            elif not self.skip:
+                self.parts.append(text)
+
+    parser = _TextParser()
+    parser.feed(_decode(data))
+    parser.close()
+    lines = (" ".join(line.split()) for line in "".join(parser.parts).splitlines())
+    return "\n".join(line for line in lines if line), {"title": parser.title.strip()}
+
+
+@register("image", [".png", ".jpg", ".jpeg", ".bmp", ".tif", ".tiff"], ["image/png", "image/jpeg", "image/bmp", "image/tiff"])
+def _extract_image(data, filename, on_progress, tesseract_cmd=None, **options):
+    # 圖片先縮放、轉灰階再 OCR，多頁 TIFF 會分頁平行辨識
+    from ocr import ocr_images
+    text, pages = ocr_images([BytesIO(data)], tesseract_cmd=tesseract_cmd, on_page=on_progress)
+    return text, {"pages": pages}
@@ -0,0 +1,78 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict
+
+from doc_store import get_doc_store
+from extractors import ExtractResult, extract
+from parse_cache import get_parse_cache, make_cache_key
+
+# 上傳檔案的解析工作：所有 session 共用一個 thread pool，多個檔案同時解析。
+# 每個檔案一個 IngestJob，解析中的進度（第幾頁 / 共幾頁）寫在 job 上，畫面那邊自己輪詢來更新進度條；
+# worker 裡不碰 Streamlit 的元件。解析完的文字放進 doc_store，順便把檢索索引建好。
+
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", 4))
+
+
+class IngestJob:
+    def __init__(self, name, key):
+        self.name = name
+        self.key = key
+        self.done = 0
+        self.total = 0
+        self.result = None    # ExtractResult；快取命中時是當初解析留下的（警告、是否截斷都還在）
+        self.cached = False   # 是否命中解析快取
+        self.handle = None    # 成功時的 DocHandle
+        self.future = None
+
+    def progress(self):
+        return self.done / self.total if self.total else 0.0
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+        return _pool
+
+
+def parse_cached(key, data, filename, mime_type=None, on_progress=None, **options):
+    """經過解析快取的 extract()，回傳 (ExtractResult, 是否命中快取)。
+
+    解析結果的警告、meta 跟文字一起存進快取，命中時一樣拿得到；只存了文字的舊快取 kind 是 None。
+    """
+    def parse():
+        result = extract(data, filename, mime_type, on_progress=on_progress, **options)
+        return result.text, {k: v for k, v in asdict(result).items() if k != "text"}
+
+    text, info, hit = get_parse_cache().get_or_parse_entry(key, parse)
+    return ExtractResult(text, **(info or {"kind": None})), hit
+
+
+def _run(job, data, mime_type, options):
+    def on_progress(done, total):
+        job.done, job.total = done, total
+
+    # 同一份檔案（內容 hash 相同）解析過就直接拿快取
+    job.result, job.cached = parse_cached(job.key, data, job.name, mime_type, on_progress, **options)
+    text = job.result.text
+    if text:
+        job.handle = get_doc_store().put(job.key, text, job.name)
+        job.handle.index()   # 檢索索引也在背景建好，提問時只要查詢
+    job.done = job.total = max(job.total, 1)
+    return job.handle
+
+
+def start_ingest(data, filename, mime_type=None, **options):
+    """把檔案丟進解析 pool，馬上回傳 IngestJob；job.future.result() 是 DocHandle（沒有文字時是 None）。
+
+    解析失敗的例外（包括不支援的格式 UnsupportedFormat）會從 future.result() 丟出來。
+    """
+    job = IngestJob(filename, make_cache_key(data, filename))
+    job.future = _get_pool().submit(_run, job, data, mime_type, options)
+    return job
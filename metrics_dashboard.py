@@ -0,0 +1,52 @@
+import time
+from datetime import datetime
+
+import streamlit as st
+
+# 管理員看的效能指標：各階段 p50/p95/p99、隨時間的變化、計數器，以及 Prometheus 格式的原始輸出。
+
+WINDOWS = {"最近 1 小時": (3600, 60), "最近 24 小時": (86400, 900), "最近 7 天": (7 * 86400, 3 * 3600)}
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+def render_metrics_dashboard(telemetry):
+    window = st.radio("時間範圍", list(WINDOWS), horizontal=True, key="metrics_window")
+    span_seconds, bucket_seconds = WINDOWS[window]
+    since = time.time() - span_seconds
+
+    summary = telemetry.span_summary(since)
+    if not summary:
+        st.caption("這段時間還沒有資料")
+        return
+    st.markdown("**各階段耗時（毫秒）**")
+    st.dataframe(
+        [{"階段": s["span"], "次數": s["count"], "失敗": s["errors"],
+          "p50": _ms(s["p50"]), "p95": _ms(s["p95"]), "p99": _ms(s["p99"])} for s in summary],
+        hide_index=True,
+    )
+
+    name = st.selectbox("趨勢", [s["span"] for s in summary], key="metrics_span")
+    series = telemetry.span_timeseries(name, since, bucket_seconds)
+    st.line_chart(
+        {
+            "時間": [datetime.fromtimestamp(p["time"]) for p in series],
+            "p50": [_ms(p["p50"]) for p in series],
+            "p95": [_ms(p["p95"]) for p in series],
+            "p99": [_ms(p["p99"]) for p in series],
+        },
+        x="時間",
+        y=["p50", "p95", "p99"],
+    )
+
+    counters = telemetry.counter_totals(since)
+    if counters:
+        st.markdown("**計數**")
+        st.dataframe([{"項目": k, "數值": round(v, 6)} for k, v in counters.items()], hide_index=True)
+
+    with st.expander("Prometheus 格式"):
+        text = telemetry.prometheus_text()
+        st.code(text, language="text")
+        st.download_button("下載 metrics.txt", text, file_name="metrics.txt")
@@ -0,0 +1,103 @@
+import re
+import threading
+
+from pricing import MODEL_PRICES
+
+# 模型路由：簡短、單純的問題交給便宜又快的模型，附檔案、長內容或需要推理的問題才用 gpt-4o。
+# 每個模型的價格來自 pricing.MODEL_PRICES，延遲（第一個 token 的時間、每秒吐幾個 token）是預設值，
+# 實際呼叫之後會用 observe() 以移動平均更新。大模型預估的回答時間超過 LATENCY_TARGET_S、小模型來得及時，
+# 就先改用小模型，不讓使用者等太久。
+
+FAST_MODEL = "gpt-4o-mini"
+STRONG_MODEL = "gpt-4o"
+
+# 預設延遲表：(第一個 token 秒數, 每秒輸出 token 數)
+MODEL_LATENCY = {
+    "gpt-4o": (0.6, 60.0),
+    "gpt-4o-mini": (0.35, 110.0),
+    "gpt-4.1": (0.6, 70.0),
+    "gpt-4.1-mini": (0.35, 100.0),
+}
+
+SHORT_PROMPT_TOKENS = 60       # 問題本身幾個 token 以內算「短」
+LONG_PROMPT_TOKENS = 1500      # 問題加上附檔段落（不含對話記憶）超過這麼多就交給大模型
+LATENCY_TARGET_S = 20.0        # 回答最長（max_tokens）寫完的預估秒數上限
+EWMA_ALPHA = 0.2
+
+# 看到這些字眼就當作需要推理、分析或寫程式的問題
+_COMPLEX_RE = re.compile(
+    r"分析|比較|推理|證明|計算|解釋|為什麼|為何|評估|規劃|策略|合約|條款|法律|程式|程式碼|除錯|翻譯|摘要|總結|報告|"
+    r"\b(analy[sz]e|compare|explain|why|prove|calculate|code|debug|refactor|translate|summari[sz]e|plan)\b",
+    re.IGNORECASE,
+)
+_CODE_RE = re.compile(r"```|def |class |function |SELECT |import ")
+
+
+class ModelRouter:
+    def __init__(self, fast_model=FAST_MODEL, strong_model=STRONG_MODEL):
+        self.fast_model = fast_model
+        self.strong_model = strong_model
+        self._lock = threading.Lock()
+        self._latency = dict(MODEL_LATENCY)
+
+    def models(self):
+        return sorted(MODEL_PRICES)
+
+    def observe(self, model, ttft, seconds, completion_tokens):
+        """用實際呼叫的延遲更新延遲表。"""
+        if model not in self._latency or not completion_tokens or seconds <= ttft:
+            return
+        with self._lock:
+            old_ttft, old_rate = self._latency[model]
+            rate = completion_tokens / (seconds - ttft)
+            self._latency[model] = (
+                old_ttft + EWMA_ALPHA * (ttft - old_ttft),
+                old_rate + EWMA_ALPHA * (rate - old_rate),
+            )
+
+    def expected_seconds(self, model, completion_tokens):
+        """照延遲表估算：第一個 token 的時間 + 寫完 completion_tokens 要的時間。"""
+        with self._lock:
+            ttft, rate = self._latency.get(model, MODEL_LATENCY["gpt-4o"])
+        return ttft + completion_tokens / rate
+
+    def route(self, question, question_tokens, has_document=False, override=None, max_tokens=1000):
+        """回傳 (模型, 原因)。override（管理員指定）優先；其餘照問題長短、有沒有附檔、內容難易度決定，
+        該用大模型但它目前預估寫完 max_tokens 會超過 LATENCY_TARGET_S 時，小模型來得及就改用小模型。"""
+        if override:
+            return override, "管理員指定"
+        if has_document:
+            reason = "附上檔案內容"
+        elif _CODE_RE.search(question):
+            reason = "包含程式碼"
+        elif _COMPLEX_RE.search(question):
+            reason = "需要分析或推理"
+        elif question_tokens > SHORT_PROMPT_TOKENS:
+            reason = "問題較長"
+        else:
+            return self.fast_model, "簡短問題"
+        if (self.expected_seconds(self.strong_model, max_tokens) > LATENCY_TARGET_S
+                and self.expected_seconds(self.fast_model, max_tokens) <= LATENCY_TARGET_S):
+            return self.fast_model, f"{reason}，但大模型目前太慢"
+        return self.strong_model, reason
+
+    def needs_long_context(self, model, content_tokens):
+        """小模型遇到很長的內容時要改用大模型；content_tokens 是問題加上附檔段落，不含對話記憶
+        （對話記憶有自己的 token 預算，算進來的話聊久了每一題都會被換成大模型）。"""
+        return model != self.strong_model and content_tokens > LONG_PROMPT_TOKENS
+
+    def latency_table(self):
+        with self._lock:
+            return {m: (round(t, 3), round(r, 1)) for m, (t, r) in self._latency.items()}
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_model_router():
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = ModelRouter()
+        return _router
@@ -0,0 +1,96 @@
+import os
+import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pytesseract
+from PIL import Image, ImageOps, ImageSequence
+
+# 圖片 OCR：先把圖片轉灰階、縮到適合辨識的解析度，多頁 TIFF / 多張圖片丟到 worker pool 平行辨識。
+# tesseract 執行檔的位置依序從 TESSERACT_CMD 環境變數（或呼叫端傳進來的設定）、PATH、Windows 預設路徑去找。
+
+OCR_LANG = os.environ.get("OCR_LANG", "eng+chi_tra")
+OCR_MAX_SIDE = 2500    # 長邊超過這個就縮小，再大對辨識率幫助不大，只會變慢
+OCR_MIN_SIDE = 800     # 太小的圖放大一點，小字才認得出來
+OCR_MAX_PAGES = 50
+OCR_TIMEOUT = 60       # 每一頁最多跑幾秒
+MAX_WORKERS = min(os.cpu_count() or 1, 4)
+
+WINDOWS_DEFAULT_CMD = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
+
+
+def find_tesseract(configured=None):
+    for candidate in (configured, os.environ.get("TESSERACT_CMD")):
+        if candidate and os.path.exists(candidate):
+            return candidate
+    found = shutil.which("tesseract")
+    if found:
+        return found
+    if os.path.exists(WINDOWS_DEFAULT_CMD):
+        return WINDOWS_DEFAULT_CMD
+    return None
+
+
+def configure_tesseract(configured=None):
+    cmd = find_tesseract(configured)
+    if cmd is None:
+        raise RuntimeError("找不到 tesseract 執行檔，請安裝 Tesseract 或設定 TESSERACT_CMD")
+    pytesseract.pytesseract.tesseract_cmd = cmd
+    return cmd
+
+
+def normalize_image(image, max_side=OCR_MAX_SIDE, min_side=OCR_MIN_SIDE):
+    """轉正方向、轉灰階，並把解析度調整到 OCR 比較有效率的範圍。"""
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("L")
+    longest = max(image.size)
+    if longest > max_side:
+        scale = max_side / longest
+    elif longest < min_side:
+        scale = min_side / longest
+    else:
+        return image
+    size = (max(1, round(image.width * scale)), max(1, round(image.height * scale)))
+    return image.resize(size, Image.LANCZOS)
+
+
+def iter_frames(images, max_pages=OCR_MAX_PAGES):
+    """把多張圖片、多頁 TIFF 攤平成一頁一頁的 frame（已正規化），最多 max_pages 頁。"""
+    count = 0
+    for image in images:
+        for frame in ImageSequence.Iterator(image):
+            if count >= max_pages:
+                return
+            yield normalize_image(frame.copy())
+            count += 1
+
+
+def _recognize(index, frame, lang, timeout):
+    start = time.perf_counter()
+    text = pytesseract.image_to_string(frame, lang=lang, timeout=timeout)
+    return index, text, time.perf_counter() - start
+
+
+def ocr_images(files, lang=OCR_LANG, max_pages=OCR_MAX_PAGES, workers=MAX_WORKERS, tesseract_cmd=None, on_page=None):
+    """files 是檔案路徑或 file-like 物件的 list，回傳 (文字, 每頁資訊 list)。
+
+    tesseract 本身是外部 process，所以用 thread pool 就能平行跑滿多核心。
+    on_page(已完成頁數, 總頁數) 每辨識完一頁呼叫一次。
+    """
+    configure_tesseract(tesseract_cmd)
+    images = [Image.open(f) for f in files]
+    frames = list(iter_frames(images, max_pages=max_pages))
+    total = len(frames)
+    results = [None] * total
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, total))) as executor:
+        futures = [executor.submit(_recognize, i, frame, lang, OCR_TIMEOUT) for i, frame in enumerate(frames)]
+        done = 0
+        for future in as_completed(futures):
+            index, text, seconds = future.result()
+            results[index] = {"page": index + 1, "chars": len(text), "seconds": round(seconds, 3), "text": text}
+            done += 1
+            if on_page:
+                on_page(done, total)
+    text = "\n\n".join(r["text"].strip() for r in results)
+    pages = [{k: v for k, v in r.items() if k != "text"} for r in results]
+    return text, pages
@@ -0,0 +1,126 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import deque
+
+from openai import (
+    APIConnectionError, APIStatusError, APITimeoutError, AsyncOpenAI, InternalServerError, OpenAI, RateLimitError,
+    Timeout,
+)
+
+# 整個 process 共用的 OpenAI client：Streamlit 每次 rerun 不再重建 client，HTTP 連線（keep-alive）可以重複使用，
+# 省掉每次重新 TLS 握手。SDK 內建的重試關掉，改用這裡的 jitter 指數退避，
+# 只重試 429、5xx、逾時、連線錯誤這類暫時性的錯誤，並統計重試次數和延遲。
+
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", 5))
+OPENAI_READ_TIMEOUT = float(os.environ.get("OPENAI_READ_TIMEOUT", 60))
+OPENAI_MAX_RETRIES = int(os.environ.get("OPENAI_MAX_RETRIES", 4))
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 20.0
+
+_RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+_RETRYABLE_STATUS = {408, 409, 429}
+
+
+def is_retryable(error):
+    if isinstance(error, _RETRYABLE_ERRORS):
+        return True
+    return isinstance(error, APIStatusError) and (error.status_code in _RETRYABLE_STATUS or error.status_code >= 500)
+
+
+def backoff_delay(attempt, error=None):
+    """第 attempt 次重試要等幾秒：full jitter 指數退避；伺服器有給 Retry-After 就照它的。"""
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    if retry_after:
+        try:
+            return min(float(retry_after), BACKOFF_MAX)
+        except ValueError:
+            pass
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+class ClientStats:
+    def __init__(self, window=1000):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.latencies = deque(maxlen=window)
+
+    def record(self, seconds=None, retried=0, failed=False):
+        with self._lock:
+            self.calls += 1
+            self.retries += retried
+            self.failures += int(failed)
+            if seconds is not None:
+                self.latencies.append(seconds)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            calls, retries, failures = self.calls, self.retries, self.failures
+
+        def pct(p):
+            return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))], 3) if latencies else None
+
+        return {"calls": calls, "retries": retries, "failures": failures,
+                "p50_s": pct(0.5), "p95_s": pct(0.95), "max_s": round(latencies[-1], 3) if latencies else None}
+
+
+stats = ClientStats()
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def _timeout():
+    return Timeout(OPENAI_READ_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT)
+
+
+def get_client(api_key):
+    """同一把 key 在整個 process 只建一個 client（底層的連線池跟著共用）。"""
+    with _clients_lock:
+        client = _clients.get(api_key)
+        if client is None:
+            client = OpenAI(api_key=api_key, timeout=_timeout(), max_retries=0)
+            _clients[api_key] = client
+        return client
+
+
+def make_async_client(api_key):
+    # async client 綁在 event loop 上，不能跨 asyncio.run() 共用，所以由呼叫端自己管理生命週期
+    return AsyncOpenAI(api_key=api_key, timeout=_timeout(), max_retries=0)
+
+
+def call_with_retry(fn, *args, max_retries=OPENAI_MAX_RETRIES, **kwargs):
+    """呼叫 fn，遇到暫時性錯誤就退避重試。串流模式只會重試建立連線這一步。"""
+    started = time.perf_counter()
+    for attempt in range(max_retries + 1):
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            if attempt < max_retries and is_retryable(e):
+                time.sleep(backoff_delay(attempt, e))
+                continue
+            stats.record(time.perf_counter() - started, retried=attempt, failed=True)
+            raise
+        stats.record(time.perf_counter() - started, retried=attempt)
+        return result
+
+
+async def acall_with_retry(fn, *args, max_retries=OPENAI_MAX_RETRIES, **kwargs):
+    started = time.perf_counter()
+    for attempt in range(max_retries + 1):
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            if attempt < max_retries and is_retryable(e):
+                await asyncio.sleep(backoff_delay(attempt, e))
+                continue
+            stats.record(time.perf_counter() - started, retried=attempt, failed=True)
+            raise
+        stats.record(time.perf_counter() - started, retried=attempt)
+        return result
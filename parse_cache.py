@@ -0,0 +1,205 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# 上傳檔案解析結果的快取：用檔案內容的 sha256 當 key，同一份檔案不管誰上傳都只解析一次。
+# 記憶體層是有容量上限的 LRU（整個 process 共用，所有 Streamlit session 都吃同一份），
+# 有設定 PARSE_CACHE_DIR 的話再多一層磁碟快取，讓重啟後或其他 process 也能命中。
+# 除了文字，還可以附帶一份 info（解析器種類、警告、有沒有被截斷…），磁碟上是同名的 .json 檔；
+# 命中快取時也能告訴使用者「只讀了前 500 頁」之類的事。
+
+DEFAULT_MAX_BYTES = int(os.environ.get("PARSE_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+DEFAULT_DISK_MAX_BYTES = int(os.environ.get("PARSE_CACHE_DISK_MAX_BYTES", 512 * 1024 * 1024))
+
+
+def make_cache_key(data, filename=""):
+    # 副檔名也放進 key，同樣的 bytes 用不同解析器的結果不會混在一起
+    ext = os.path.splitext(filename)[1].lower().lstrip(".")
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{digest}.{ext}" if ext else digest
+
+
+class ParseCache:
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, disk_dir=None, disk_max_bytes=DEFAULT_DISK_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.disk_dir = disk_dir
+        self.disk_max_bytes = disk_max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if disk_dir:
+            os.makedirs(disk_dir, exist_ok=True)
+
+    # ---- 記憶體層 ----
+    def _mem_get(self, key):
+        # 回傳 (text, info)，沒有就是 None
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+        return entry
+
+    def _mem_put(self, key, text, info=None):
+        size = len(text.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= len(old[0].encode("utf-8"))
+        self._entries[key] = (text, info)
+        self._bytes += size
+        while self._bytes > self.max_bytes and self._entries:
+            _, (evicted, _) = self._entries.popitem(last=False)
+            self._bytes -= len(evicted.encode("utf-8"))
+
+    # ---- 磁碟層 ----
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, key[:2], key + ".txt")
+
+    def _disk_get(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                text = f.read()
+            os.utime(path)  # 更新 mtime，當作磁碟層的 LRU 時間
+        except OSError:
+            return None
+        try:
+            with open(path[:-4] + ".json", "r", encoding="utf-8") as f:
+                info = json.load(f)
+        except (OSError, ValueError):
+            info = None   # 舊版只存了文字
+        return text, info
+
+    def _write(self, path, content):
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(content)
+        os.replace(tmp, path)  # 原子替換，其他 process 不會讀到寫一半的檔案
+
+    def _disk_put(self, key, text, info=None):
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # info 先寫，讀到 .txt 的人一定也讀得到對應的 info
+            if info is not None:
+                self._write(path[:-4] + ".json", json.dumps(info, ensure_ascii=False, default=str))
+            self._write(path, text)
+            self._disk_trim()
+        except OSError:
+            pass
+
+    def _disk_trim(self):
+        files = []
+        total = 0
+        for root, _, names in os.walk(self.disk_dir):
+            for name in names:
+                if not name.endswith(".txt"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    info = os.stat(path)
+                except OSError:
+                    continue
+                files.append((info.st_mtime, info.st_size, path))
+                total += info.st_size
+        if total <= self.disk_max_bytes:
+            return
+        for _, size, path in sorted(files):
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            try:
+                os.remove(path[:-4] + ".json")
+            except OSError:
+                pass
+            total -= size
+            if total <= self.disk_max_bytes:
+                break
+
+    # ---- 對外介面 ----
+    def get_entry(self, key):
+        """回傳 (text, info)，沒有快取回傳 None；info 可能是 None。"""
+        with self._lock:
+            entry = self._mem_get(key)
+            if entry is not None:
+                self.hits += 1
+                return entry
+        entry = self._disk_get(key)
+        with self._lock:
+            if entry is not None:
+                self.disk_hits += 1
+                self._mem_put(key, *entry)
+            else:
+                self.misses += 1
+        return entry
+
+    def get(self, key):
+        entry = self.get_entry(key)
+        return entry[0] if entry is not None else None
+
+    def put(self, key, text, info=None):
+        if not text:
+            return
+        with self._lock:
+            self._mem_put(key, text, info)
+        self._disk_put(key, text, info)
+
+    def get_or_parse_entry(self, key, parse_fn):
+        """有快取就直接回傳，沒有就呼叫 parse_fn() 拿 (text, info)；同一個 key 同時只會有一個人在解析。
+
+        回傳 (text, info, 是否命中快取)。
+        """
+        entry = self.get_entry(key)
+        if entry is not None:
+            return entry[0], entry[1], True
+        with self._lock:
+            key_lock = self._inflight.setdefault(key, threading.Lock())
+        with key_lock:
+            # 等別人解析完之後再看一次，就不用重複解析
+            with self._lock:
+                entry = self._mem_get(key)
+            hit = entry is not None
+            if not hit:
+                entry = parse_fn()
+                self.put(key, *entry)
+        with self._lock:
+            self._inflight.pop(key, None)
+        return entry[0], entry[1], hit
+
+    def get_or_parse(self, key, parse_fn):
+        """只要文字的版本：parse_fn() 回傳 text。"""
+        return self.get_or_parse_entry(key, lambda: (parse_fn(), None))[0]
+
+    def stats(self):
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+            }
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_parse_cache():
+    """整個 process 共用同一個快取（Streamlit 的每個 session 都是同一個 process 裡的 thread）。"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ParseCache(disk_dir=os.environ.get("PARSE_CACHE_DIR") or None)
+        return _cache
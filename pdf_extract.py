@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+import PyPDF2
+
+# PDF 解析：一頁一頁用 generator 吐出來，頁數多的檔案分批丟到 process pool 平行解析，
+# 超過頁數或字數上限就提早停，不會把整份幾百頁的手冊一次塞進記憶體。
+
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", 500))
+PDF_MAX_CHARS = int(os.environ.get("PDF_MAX_CHARS", 2_000_000))
+PARALLEL_MIN_PAGES = 40   # 頁數少於這個就直接在目前的 thread 解析，開 process 反而比較慢
+BATCH_PAGES = 16
+MAX_WORKERS = min(os.cpu_count() or 1, 4)
+
+_worker_data = None
+
+
+def _init_worker(data):
+    # 每個 worker 只收一次 PDF bytes，之後每批只傳頁碼
+    global _worker_data
+    _worker_data = data
+
+
+def _extract_range(start, stop):
+    reader = PyPDF2.PdfReader(BytesIO(_worker_data))
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+
+def _pool_context():
+    # Streamlit 本身有很多 thread，用 fork 有機會卡死，所以改用 forkserver / spawn
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def count_pages(data):
+    return len(PyPDF2.PdfReader(BytesIO(data)).pages)
+
+
+def iter_pdf_pages(data, max_pages=PDF_MAX_PAGES, workers=MAX_WORKERS):
+    """依頁碼順序 yield (頁碼, 要解析的總頁數, 文字)。呼叫端不再迭代時，還沒跑的批次會被取消。"""
+    reader = PyPDF2.PdfReader(BytesIO(data))
+    total = min(len(reader.pages), max_pages) if max_pages else len(reader.pages)
+
+    if total < PARALLEL_MIN_PAGES or workers <= 1:
+        for i in range(total):
+            yield i, total, reader.pages[i].extract_text() or ""
+        return
+
+    del reader
+    executor = ProcessPoolExecutor(
+        max_workers=workers, mp_context=_pool_context(), initializer=_init_worker, initargs=(data,)
+    )
+    try:
+        futures = [
+            executor.submit(_extract_range, start, min(start + BATCH_PAGES, total))
+            for start in range(0, total, BATCH_PAGES)
+        ]
+        page = 0
+        for future in futures:
+            for text in future.result():
+                yield page, total, text
+                page += 1
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_pdf_text(data, max_pages=PDF_MAX_PAGES, max_chars=PDF_MAX_CHARS, on_page=None):
+    """回傳 (文字, 資訊)。資訊裡有實際讀了幾頁、總頁數、是否因為上限被截斷。
+
+    on_page(已完成頁數, 總頁數) 每解析完一頁就會被呼叫一次，可以拿來更新進度條。
+    """
+    all_pages = count_pages(data)
+    parts = []
+    chars = 0
+    pages_read = 0
+    truncated = bool(max_pages) and all_pages > max_pages
+    for page, total, text in iter_pdf_pages(data, max_pages=max_pages):
+        if max_chars and chars + len(text) > max_chars:
+            if max_chars > chars:
+                parts.append(text[:max_chars - chars])
+            pages_read = page + 1
+            truncated = True
+            break
+        parts.append(text)
+        chars += len(text) + 1
+        pages_read = page + 1
+        if on_page:
+            on_page(pages_read, total)
+    info = {"pages_read": pages_read, "total_pages": all_pages, "truncated": truncated}
+    return "\n".join(parts), info
@@ -0,0 +1,109 @@
+import math
+import os
+import re
+import threading
+
+# token 計算與模型價格。送出前用本機 tokenizer（tiktoken）估算 prompt token，
+# 加上最壞情況的回答 token（max_tokens），就能在呼叫 API 之前知道最多會花多少錢。
+# tiktoken 第一次用到某個編碼時會從網路下載編碼表，存在 TIKTOKEN_CACHE_DIR（預設是專案裡的 .tiktoken_cache），
+# 之後就不用再連網。離線的伺服器要先在能連網的地方跑一次 count_tokens，把這個資料夾一起帶過去。
+# tiktoken 下載時沒有設逾時，所以 import 時就在背景開始載入預設編碼，用到時最多只等 ENCODING_LOAD_TIMEOUT 秒，
+# 不會讓使用者的第一個請求卡在防火牆後面等 TCP 逾時。
+# 沒裝 tiktoken、下載失敗或逾時才退回粗估：中日韓文字一字一 token，其他四個字元一 token（可能會低估）。
+
+# 預設的暫存資料夾可能被系統清掉，改放在專案裡；要在 import tiktoken 之前設定
+os.environ.setdefault("TIKTOKEN_CACHE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), ".tiktoken_cache"))
+
+# 每 1K token 的價格（美元）：(輸入, 輸出)
+MODEL_PRICES = {
+    "gpt-4o": (0.0025, 0.01),
+    "gpt-4o-mini": (0.00015, 0.0006),
+    "gpt-4.1": (0.002, 0.008),
+    "gpt-4.1-mini": (0.0004, 0.0016),
+}
+DEFAULT_PRICE = MODEL_PRICES["gpt-4o"]
+
+# 每則訊息在 chat 格式裡額外佔用的 token（role、分隔符號）
+TOKENS_PER_MESSAGE = 3
+TOKENS_PER_REPLY = 3
+
+DEFAULT_ENCODING = "o200k_base"   # gpt-4o、gpt-4.1 系列都用這個編碼
+ENCODING_LOAD_TIMEOUT = 5         # 秒；載入編碼表最多等這麼久，逾時就先用粗估
+
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿]")
+_encodings = {}   # 編碼名稱 -> tiktoken 的 Encoding；None 表示載入失敗或逾時，之後都用粗估
+_loaders = {}     # 編碼名稱 -> 載入編碼表的背景 thread
+_loaders_lock = threading.Lock()
+
+
+def _encoding_name(model):
+    try:
+        from tiktoken.model import encoding_name_for_model
+        return encoding_name_for_model(model)
+    except Exception:   # 沒裝 tiktoken，或 tiktoken 不認得這個模型
+        return DEFAULT_ENCODING
+
+
+def _load(name):
+    try:
+        import tiktoken
+        enc = tiktoken.get_encoding(name)
+    except Exception:
+        # 沒裝 tiktoken，或第一次使用時下載編碼表失敗（例如離線）
+        enc = None
+    _encodings[name] = enc
+
+
+def preload_encoding(name=DEFAULT_ENCODING):
+    """在背景載入編碼表（第一次要下載），每個編碼只載入一次；回傳載入中的 thread。"""
+    with _loaders_lock:
+        if name not in _loaders:
+            _loaders[name] = threading.Thread(target=_load, args=(name,), daemon=True)
+            _loaders[name].start()
+        return _loaders[name]
+
+
+def _encoding(model):
+    name = _encoding_name(model)
+    if name not in _encodings:
+        preload_encoding(name).join(ENCODING_LOAD_TIMEOUT)
+        # 逾時就先記成失敗，之後不用再等；背景下載要是之後完成了，會換成真的編碼
+        _encodings.setdefault(name, None)
+    return _encodings[name]
+
+
+def estimate_tokens(text):
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def count_tokens(text, model="gpt-4o"):
+    enc = _encoding(model)
+    if enc is None:
+        return estimate_tokens(text)
+    return len(enc.encode(text, disallowed_special=()))
+
+
+def count_message_tokens(messages, model="gpt-4o"):
+    return sum(TOKENS_PER_MESSAGE + count_tokens(m["content"], model) for m in messages) + TOKENS_PER_REPLY
+
+
+def cost_usd(model, prompt_tokens, completion_tokens):
+    input_rate, output_rate = MODEL_PRICES.get(model, DEFAULT_PRICE)
+    return round(prompt_tokens * input_rate / 1000 + completion_tokens * output_rate / 1000, 6)
+
+
+def worst_case_cost(model, prompt_tokens, max_tokens):
+    """prompt 已知、回答用滿 max_tokens 時的花費上限。"""
+    return cost_usd(model, prompt_tokens, max_tokens)
+
+
+def affordable_completion_tokens(model, prompt_tokens, budget_usd):
+    """扣掉 prompt 的花費之後，剩下的預算最多還能讓模型回答幾個 token。"""
+    input_rate, output_rate = MODEL_PRICES.get(model, DEFAULT_PRICE)
+    left = budget_usd - prompt_tokens * input_rate / 1000
+    return max(0, int(left * 1000 / output_rate))
+
+
+# import 時就開始在背景載入，第一個請求通常不用等
+preload_encoding()
@@ -0,0 +1,173 @@
+import itertools
+import os
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# 全域請求排程：所有 session 共用同一組限額，避免尖峰時大家各自打 API、一起撞到帳號的 RPM / TPM 上限（429）。
+# - 請求數、token 數各一個 token bucket（每分鐘補滿）
+# - 每個使用者同時最多跑 PER_USER_CONCURRENCY 個請求，一個人洗版不會卡住其他人
+# - 排隊照 (優先權, 先來後到)；管理員走優先通道
+# 呼叫端拿到的是「可以送了」的許可，送完要 release，實際用量比預留少的 token 會還回去。
+
+RATE_LIMIT_RPM = int(os.environ.get("RATE_LIMIT_RPM", 500))
+RATE_LIMIT_TPM = int(os.environ.get("RATE_LIMIT_TPM", 30000))
+PER_USER_CONCURRENCY = int(os.environ.get("PER_USER_CONCURRENCY", 2))
+QUEUE_TIMEOUT = float(os.environ.get("QUEUE_TIMEOUT", 120))
+
+PRIORITY_ADMIN = 0
+PRIORITY_NORMAL = 1
+
+_POLL_SECONDS = 0.5
+
+
+class QueueTimeout(RuntimeError):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, capacity, per_minute):
+        self.capacity = float(capacity)
+        self.rate = per_minute / 60.0
+        self.level = float(capacity)
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount):
+        """還要等幾秒桶子裡才有 amount。"""
+        self._refill()
+        return max(0.0, (amount - self.level) / self.rate)
+
+    def take(self, amount):
+        self._refill()
+        self.level -= amount
+
+    def give_back(self, amount):
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+
+class RequestScheduler:
+    def __init__(self, rpm=RATE_LIMIT_RPM, tpm=RATE_LIMIT_TPM, per_user=PER_USER_CONCURRENCY, timeout=QUEUE_TIMEOUT):
+        self.requests = TokenBucket(rpm, rpm)
+        self.tokens = TokenBucket(tpm, tpm)
+        self.per_user = per_user
+        self.timeout = timeout
+        self._cond = threading.Condition()
+        self._queue = []          # 等待中的 ticket，依 (priority, seq) 排序
+        self._running = Counter()
+        self._seq = itertools.count()
+        self.served = 0
+        self.timeouts = 0
+
+    def _eligible(self):
+        # 已經達到同時上限的使用者先跳過，讓後面其他人的請求可以先走
+        return [t for t in self._queue if self._running[t["user"]] < self.per_user]
+
+    def _estimate_wait(self, ticket, eligible):
+        """前面排的請求都消化掉、桶子也補夠之後，大約還要等幾秒。"""
+        if ticket not in eligible:
+            return None   # 在等自己前一個請求跑完
+        ahead = eligible[:eligible.index(ticket) + 1]
+        return max(
+            self.requests.wait_time(len(ahead)),
+            self.tokens.wait_time(sum(t["tokens"] for t in ahead)),
+        )
+
+    def acquire(self, username, tokens, priority=PRIORITY_NORMAL, on_wait=None, timeout=None):
+        """排隊直到可以送出請求，回傳 ticket（送完交給 release）。
+
+        tokens 是這次最多會用掉的 token（prompt + max_tokens）；on_wait(前面還有幾個, 預估秒數) 在排隊時定期呼叫。
+        超過 timeout 秒還沒輪到就丟 QueueTimeout。
+        """
+        timeout = self.timeout if timeout is None else timeout
+        ticket = {
+            "user": username,
+            "tokens": min(max(int(tokens), 1), int(self.tokens.capacity)),   # 超過整桶的請求永遠等不到，最多預留一整桶
+            "priority": priority,
+            "seq": next(self._seq),
+            "enqueued": time.monotonic(),
+        }
+        deadline = ticket["enqueued"] + timeout
+        with self._cond:
+            self._queue.append(ticket)
+            self._queue.sort(key=lambda t: (t["priority"], t["seq"]))
+        try:
+            while True:
+                with self._cond:
+                    eligible = self._eligible()
+                    if eligible and eligible[0] is ticket \
+                            and self.requests.wait_time(1) == 0 and self.tokens.wait_time(ticket["tokens"]) == 0:
+                        self._queue.remove(ticket)
+                        self.requests.take(1)
+                        self.tokens.take(ticket["tokens"])
+                        self._running[username] += 1
+                        self.served += 1
+                        ticket["waited"] = time.monotonic() - ticket["enqueued"]
+                        return ticket
+                    position = eligible.index(ticket) if ticket in eligible else len(eligible)
+                    eta = self._estimate_wait(ticket, eligible)
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    with self._cond:
+                        self.timeouts += 1   # 只算真的逾時；Streamlit 停止、rerun 之類的中斷不算
+                    raise QueueTimeout(f"排隊超過 {timeout:g} 秒")
+                if on_wait is not None:
+                    on_wait(position, eta)
+                with self._cond:
+                    self._cond.wait(min(_POLL_SECONDS, remaining, eta or _POLL_SECONDS))
+        except BaseException:
+            with self._cond:
+                if ticket in self._queue:
+                    self._queue.remove(ticket)
+                self._cond.notify_all()
+            raise
+
+    def release(self, ticket, used_tokens=None):
+        """請求結束。used_tokens 是實際用量，預留多的部分還給 token 桶。"""
+        with self._cond:
+            self._running[ticket["user"]] -= 1
+            if self._running[ticket["user"]] <= 0:
+                del self._running[ticket["user"]]
+            if used_tokens is not None and used_tokens < ticket["tokens"]:
+                self.tokens.give_back(ticket["tokens"] - used_tokens)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, username, tokens, priority=PRIORITY_NORMAL, on_wait=None, timeout=None):
+        # with 區塊裡可以把實際用量寫進 ticket["used_tokens"]
+        ticket = self.acquire(username, tokens, priority, on_wait, timeout)
+        try:
+            yield ticket
+        finally:
+            self.release(ticket, ticket.get("used_tokens"))
+
+    def snapshot(self):
+        with self._cond:
+            self.requests.wait_time(0)   # 先把桶子補到現在
+            self.tokens.wait_time(0)
+            return {
+                "queued": len(self._queue),
+                "running": sum(self._running.values()),
+                "served": self.served,
+                "timeouts": self.timeouts,
+                "requests_left": int(self.requests.level),
+                "tokens_left": int(self.tokens.level),
+            }
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = RequestScheduler()
+        return _scheduler
@@ -0,0 +1,178 @@
+import math
+import re
+import sys
+from collections import Counter
+
+import numpy as np
+
+from pricing import count_tokens
+
+# 本機的檢索索引：上傳時把檔案切成段落建一次 BM25 索引，
+# 之後每個問題只挑最相關的幾段放進 prompt，不用整份檔案每次都送出去。
+# 完全不需要網路，也不用另外的 embedding 模型。
+
+CHUNK_CHARS = 800
+CHUNK_OVERLAP = 100
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_CJK_RE = re.compile(r"[㐀-鿿豈-﫿]")
+_TERM_RE = re.compile(r"[㐀-鿿豈-﫿]+|[a-z0-9]+")
+
+
+def tokenize(text):
+    # 英數字用單字，中文用二字詞（bigram），單一個中文字也保留，短問題才找得到
+    terms = []
+    for match in _TERM_RE.findall(text.lower()):
+        if _CJK_RE.match(match):
+            if len(match) == 1:
+                terms.append(match)
+            else:
+                terms.extend(match[i:i + 2] for i in range(len(match) - 1))
+        else:
+            terms.append(match)
+    return terms
+
+
+def split_chunks(text, chunk_chars=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+    """依段落切塊，段落太長就硬切，相鄰兩塊留一點重疊避免句子被切斷。"""
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n|\n", text) if p.strip()]
+    chunks = []
+    current = ""
+    for para in paragraphs:
+        while len(para) > chunk_chars:
+            if current:
+                chunks.append(current)
+                current = ""
+            chunks.append(para[:chunk_chars])
+            para = para[chunk_chars - overlap:]
+        if current and len(current) + len(para) + 1 > chunk_chars:
+            chunks.append(current)
+            current = current[-overlap:] + "\n" + para if overlap else para
+        else:
+            current = f"{current}\n{para}" if current else para
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class RetrievalIndex:
+    def __init__(self, text, chunk_chars=CHUNK_CHARS, overlap=CHUNK_OVERLAP):
+        self.chunks = split_chunks(text, chunk_chars, overlap)
+        self.chunk_tokens = np.array([count_tokens(c) for c in self.chunks], dtype=np.int64)
+        self.total_tokens = int(self.chunk_tokens.sum())
+
+        # 倒排索引：每個詞記下出現在哪些段落、出現幾次
+        postings = {}
+        lengths = np.zeros(len(self.chunks), dtype=np.float64)
+        for i, chunk in enumerate(self.chunks):
+            terms = tokenize(chunk)
+            lengths[i] = len(terms)
+            for term, tf in Counter(terms).items():
+                postings.setdefault(term, ([], []))
+                postings[term][0].append(i)
+                postings[term][1].append(tf)
+
+        n = len(self.chunks)
+        self._lengths = lengths
+        self._avg_length = float(lengths.mean()) if n else 0.0
+        self._postings = {}
+        for term, (ids, tfs) in postings.items():
+            df = len(ids)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            self._postings[term] = (np.array(ids, dtype=np.int64), np.array(tfs, dtype=np.float64), idf)
+
+    def __len__(self):
+        return len(self.chunks)
+
+    def nbytes(self):
+        """粗估索引在記憶體裡佔多少 bytes（段落字串 + numpy 陣列 + 倒排表）。"""
+        size = sum(sys.getsizeof(c) for c in self.chunks) + self.chunk_tokens.nbytes + self._lengths.nbytes
+        for term, (ids, tfs, _) in self._postings.items():
+            size += sys.getsizeof(term) + ids.nbytes + tfs.nbytes + 200
+        return size
+
+    def score(self, query):
+        scores = np.zeros(len(self.chunks), dtype=np.float64)
+        if not self.chunks:
+            return scores
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self._lengths / max(self._avg_length, 1e-9))
+        for term in set(tokenize(query)):
+            entry = self._postings.get(term)
+            if entry is None:
+                continue
+            ids, tfs, idf = entry
+            scores[ids] += idf * tfs * (BM25_K1 + 1) / (tfs + norm[ids])
+        return scores
+
+    def select(self, query, top_k=6, token_budget=2000):
+        """回傳要放進 prompt 的段落編號（依原文順序），總 token 不超過 token_budget。
+
+        整份檔案本來就塞得下的話直接全部給，不用挑。
+        """
+        if self.total_tokens <= token_budget:
+            return list(range(len(self.chunks)))
+        scores = self.score(query)
+        # 分數一樣（例如問題完全沒命中）就取前面的段落
+        order = np.lexsort((np.arange(len(scores)), -scores))
+        picked = []
+        used = 0
+        for i in order[:max(top_k, 0) * 4]:
+            if len(picked) >= top_k:
+                break
+            cost = int(self.chunk_tokens[i])
+            if used + cost > token_budget:
+                continue
+            picked.append(int(i))
+            used += cost
+        return sorted(picked)
+
+    def build_context(self, query, top_k=6, token_budget=2000):
+        picked = self.select(query, top_k, token_budget)
+        context = "\n\n".join(f"[段落 {i + 1}]\n{self.chunks[i]}" for i in picked)
+        return context, picked
+
+
+def select_across(indexes, query, top_k=6, token_budget=2000):
+    """從多份文件一起挑段落，共用同一個 token 預算。回傳 [(第幾份文件, 段落編號), ...]（依文件、原文順序）。
+
+    各文件的 BM25 分數先除以該文件的最高分，彼此才比得起來；每份文件先保證挑到自己最相關的一段
+    （比較兩份文件時兩邊都要有內容），剩下的名額再照分數高低分配。
+    """
+    if sum(index.total_tokens for index in indexes) <= token_budget:
+        return [(d, i) for d, index in enumerate(indexes) for i in range(len(index.chunks))]
+    ranked = []
+    for d, index in enumerate(indexes):
+        if not index.chunks:
+            continue
+        scores = index.score(query)
+        top = scores.max()
+        normalized = scores / top if top > 0 else scores
+        order = np.lexsort((np.arange(len(scores)), -scores))
+        ranked.append([(float(normalized[i]), d, int(i)) for i in order[:max(top_k, 0) * 4]])
+
+    firsts = [r[0] for r in ranked if r]
+    rest = sorted((c for r in ranked for c in r[1:]), key=lambda c: (-c[0], c[1], c[2]))
+    picked = []
+    used = 0
+    for _, d, i in firsts + rest:
+        if len(picked) >= top_k:
+            break
+        cost = int(indexes[d].chunk_tokens[i])
+        if used + cost > token_budget:
+            continue
+        picked.append((d, i))
+        used += cost
+    return sorted(picked)
+
+
+def build_multi_context(named_indexes, query, top_k=6, token_budget=2000):
+    """named_indexes 是 [(檔名, RetrievalIndex), ...]。只有一份文件時跟 build_context 的格式一樣。"""
+    if len(named_indexes) == 1:
+        context, picked = named_indexes[0][1].build_context(query, top_k, token_budget)
+        return context, [(0, i) for i in picked]
+    picked = select_across([index for _, index in named_indexes], query, top_k, token_budget)
+    context = "\n\n".join(
+        f"[{named_indexes[d][0]} 段落 {i + 1}]\n{named_indexes[d][1].chunks[i]}" for d, i in picked
+    )
+    return context, picked
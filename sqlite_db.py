@@ -0,0 +1,41 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# 帳本、回答快取、遙測、對話紀錄共用的 SQLite 連線。
+# Streamlit 每次 rerun 都在新的 thread 上跑，每個 thread 各開一條連線的話，幾乎每次 rerun 都要重開連線、重設 PRAGMA。
+# 所以每個資料庫檔案在整個 process 只開一條連線（check_same_thread=False），用 lock 保證同一時間只有一個 thread 在用。
+# 不同 process 之間靠 WAL 模式和 busy_timeout 協調。
+
+
+class SharedDB:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=30000")
+
+    @contextmanager
+    def transaction(self):
+        """拿著 lock 執行一個 transaction：區塊正常結束就 commit，丟出例外就 rollback。"""
+        with self._lock, self._conn:
+            yield self._conn
+
+    def query(self, sql, params=()):
+        """唯讀查詢，回傳所有結果列。"""
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+
+_dbs = {}
+_dbs_lock = threading.Lock()
+
+
+def get_db(path):
+    global _dbs
+    with _dbs_lock:
+        if path not in _dbs:
+            _dbs[path] = SharedDB(path)
+        return _dbs[path]
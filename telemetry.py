@@ -0,0 +1,222 @@
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlite_db import get_db
+
+# 效能遙測：記錄每個請求各階段花的時間（span）和計數（counter），例如檔案解析、排隊、第一個 token、整段生成、
+# 對話紀錄重畫，以及 token 數、花費、快取命中、錯誤次數。
+# - 明細先放記憶體緩衝區，批次寫進本機 SQLite（只保留 TELEMETRY_RETENTION_DAYS 天），管理員頁面從這裡查 p50/p95/p99
+# - 同時在記憶體累計 Prometheus 格式的 histogram / counter；有設 METRICS_PORT 就開一個 /metrics 給 Prometheus 來抓
+
+TELEMETRY_DB = os.environ.get("TELEMETRY_DB", "telemetry.db")
+TELEMETRY_RETENTION_DAYS = float(os.environ.get("TELEMETRY_RETENTION_DAYS", 7))
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))
+FLUSH_EVERY = 100        # 緩衝區累積幾筆就寫入
+FLUSH_SECONDS = 5.0      # 或距離上次寫入超過幾秒
+
+# Prometheus histogram 的分界（秒）
+BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, float("inf"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS metrics (
+    ts REAL NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    value REAL NOT NULL,
+    username TEXT,
+    ok INTEGER NOT NULL DEFAULT 1
+);
+CREATE INDEX IF NOT EXISTS idx_metrics_name_ts ON metrics (name, ts);
+CREATE INDEX IF NOT EXISTS idx_metrics_ts ON metrics (ts);
+"""
+
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    return sorted_values[min(len(sorted_values) - 1, int(p * len(sorted_values)))]
+
+
+class Telemetry:
+    def __init__(self, path=TELEMETRY_DB, retention_days=TELEMETRY_RETENTION_DAYS):
+        self.path = path
+        self.retention = retention_days * 86400
+        self._db = get_db(path)
+        self._lock = threading.Lock()
+        self._buffer = []
+        self._last_flush = time.time()
+        self._last_trim = 0.0
+        # Prometheus 用的累計值（process 啟動以來）
+        self._histograms = defaultdict(lambda: [0] * len(BUCKETS))
+        self._sums = defaultdict(float)
+        self._counts = defaultdict(int)
+        self._errors = defaultdict(int)
+        self._counters = defaultdict(float)
+        with self._db.transaction() as conn:
+            conn.executescript(_SCHEMA)
+        atexit.register(self.flush)
+
+    def _add(self, row):
+        with self._lock:
+            self._buffer.append(row)
+            due = len(self._buffer) >= FLUSH_EVERY or time.time() - self._last_flush >= FLUSH_SECONDS
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+            self._last_flush = now = time.time()
+            trim = now - self._last_trim > 600
+            if trim:
+                self._last_trim = now
+        if not rows and not trim:
+            return
+        with self._db.transaction() as conn:
+            conn.executemany("INSERT INTO metrics (ts, kind, name, value, username, ok) VALUES (?, ?, ?, ?, ?, ?)", rows)
+            if trim:
+                conn.execute("DELETE FROM metrics WHERE ts < ?", (now - self.retention,))
+
+    def observe(self, name, seconds, username=None, ok=True):
+        """記一筆 span（耗時幾秒）。"""
+        with self._lock:
+            buckets = self._histograms[name]
+            for i, bound in enumerate(BUCKETS):
+                if seconds <= bound:
+                    buckets[i] += 1
+                    break
+            self._sums[name] += seconds
+            self._counts[name] += 1
+            if not ok:
+                self._errors[name] += 1
+        self._add((time.time(), "span", name, float(seconds), username, int(ok)))
+
+    def count(self, name, value=1, username=None):
+        """累加 counter，例如 tokens_in、cost_usd、answer_cache_hit。"""
+        if not value:
+            return
+        with self._lock:
+            self._counters[name] += value
+        self._add((time.time(), "counter", name, float(value), username, 1))
+
+    @contextmanager
+    def span(self, name, username=None):
+        # with 區塊丟出例外就記成失敗的 span
+        started = time.perf_counter()
+        ok = False
+        try:
+            yield
+            ok = True
+        finally:
+            self.observe(name, time.perf_counter() - started, username, ok)
+
+    # ========= 查詢（管理員頁面用） =========
+
+    def span_summary(self, since):
+        """since 之後每一種 span 的次數、失敗數和 p50/p95/p99。"""
+        self.flush()
+        values = defaultdict(list)
+        errors = defaultdict(int)
+        for name, value, ok in self._db.query(
+            "SELECT name, value, ok FROM metrics WHERE kind = 'span' AND ts >= ?", (since,)
+        ):
+            values[name].append(value)
+            errors[name] += 1 - ok
+        summary = []
+        for name in sorted(values):
+            v = sorted(values[name])
+            summary.append({
+                "span": name, "count": len(v), "errors": errors[name],
+                "p50": percentile(v, 0.5), "p95": percentile(v, 0.95), "p99": percentile(v, 0.99),
+            })
+        return summary
+
+    def span_timeseries(self, name, since, bucket_seconds=300):
+        """把 since 之後的某個 span 按時間分桶，每桶算 p50/p95/p99。"""
+        self.flush()
+        buckets = defaultdict(list)
+        for ts, value in self._db.query(
+            "SELECT ts, value FROM metrics WHERE kind = 'span' AND name = ? AND ts >= ? ORDER BY ts", (name, since)
+        ):
+            buckets[int(ts // bucket_seconds) * bucket_seconds].append(value)
+        series = []
+        for start in sorted(buckets):
+            v = sorted(buckets[start])
+            series.append({"time": start, "count": len(v),
+                           "p50": percentile(v, 0.5), "p95": percentile(v, 0.95), "p99": percentile(v, 0.99)})
+        return series
+
+    def counter_totals(self, since):
+        self.flush()
+        return dict(self._db.query(
+            "SELECT name, SUM(value) FROM metrics WHERE kind = 'counter' AND ts >= ? GROUP BY name ORDER BY name", (since,)
+        ))
+
+    def prometheus_text(self):
+        """process 啟動以來的累計值，Prometheus text exposition format。"""
+        lines = [
+            "# HELP chatai_span_seconds Time spent in each stage of a request.",
+            "# TYPE chatai_span_seconds histogram",
+        ]
+        with self._lock:
+            for name in sorted(self._histograms):
+                cumulative = 0
+                for bound, n in zip(BUCKETS, self._histograms[name]):
+                    cumulative += n
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f'chatai_span_seconds_bucket{{span="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'chatai_span_seconds_sum{{span="{name}"}} {self._sums[name]}')
+                lines.append(f'chatai_span_seconds_count{{span="{name}"}} {self._counts[name]}')
+            lines.append("# HELP chatai_span_errors_total Spans that ended with an error.")
+            lines.append("# TYPE chatai_span_errors_total counter")
+            for name in sorted(self._counts):
+                lines.append(f'chatai_span_errors_total{{span="{name}"}} {self._errors[name]}')
+            for name in sorted(self._counters):
+                lines.append(f"# TYPE chatai_{name}_total counter")
+                lines.append(f"chatai_{name}_total {self._counters[name]}")
+        return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = get_telemetry().prometheus_text().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_metrics_server(port):
+    """在背景 thread 開 http://0.0.0.0:port/metrics（整個 process 一個）。"""
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+
+
+_telemetry = None
+_telemetry_lock = threading.Lock()
+
+
+def get_telemetry():
+    global _telemetry
+    with _telemetry_lock:
+        if _telemetry is None:
+            _telemetry = Telemetry()
+            if METRICS_PORT:
+                try:
+                    start_metrics_server(METRICS_PORT)
+                except OSError:
+                    pass   # port 被占用（例如另一個 worker 已經開了），就只用管理員頁面
+        return _telemetry
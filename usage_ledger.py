@@ -0,0 +1,86 @@
+import os
+import threading
+import time
+from datetime import date
+
+from sqlite_db import get_db
+
+# 使用量帳本：每一次呼叫 API 都 append 一筆紀錄（誰、哪天、用哪個模型、多少 token、花多少錢）。
+# 存在 SQLite（WAL 模式），多個 Streamlit session 同時寫也不會互相蓋掉，重啟後資料也還在。
+# 每日額度檢查靠 (username, day) 索引做 SUM，不用把整個檔案讀進來。
+
+USAGE_DB = os.environ.get("USAGE_DB", "usage.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    ts REAL NOT NULL,
+    day TEXT NOT NULL,
+    username TEXT NOT NULL,
+    model TEXT,
+    kind TEXT NOT NULL DEFAULT 'chat',
+    prompt_tokens INTEGER NOT NULL DEFAULT 0,
+    completion_tokens INTEGER NOT NULL DEFAULT 0,
+    total_tokens INTEGER NOT NULL DEFAULT 0,
+    cost_usd REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_usage_user_day ON usage (username, day);
+CREATE INDEX IF NOT EXISTS idx_usage_day ON usage (day);
+"""
+
+
+class UsageLedger:
+    def __init__(self, path=USAGE_DB):
+        self.path = path
+        self._db = get_db(path)
+        with self._db.transaction() as conn:
+            conn.executescript(_SCHEMA)
+
+    def record(self, username, cost_usd, total_tokens=0, model=None, prompt_tokens=0, completion_tokens=0,
+               kind="chat", day=None):
+        day = day or str(date.today())
+        with self._db.transaction() as conn:   # with 區塊結束自動 commit，一筆就是一個 transaction
+            conn.execute(
+                "INSERT INTO usage (ts, day, username, model, kind, prompt_tokens, completion_tokens, total_tokens, cost_usd) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), day, username, model, kind, prompt_tokens, completion_tokens, total_tokens, cost_usd),
+            )
+
+    def spent_on(self, username, day=None):
+        day = day or str(date.today())
+        return self._db.query(
+            "SELECT COALESCE(SUM(cost_usd), 0) FROM usage WHERE username = ? AND day = ?", (username, day)
+        )[0][0]
+
+    def daily_totals(self, username=None, limit=30):
+        """回傳最近 limit 天的 [(日期, 花費)]；username 是 None 就是所有人加總。"""
+        if username is None:
+            rows = self._db.query(
+                "SELECT day, SUM(cost_usd) FROM usage GROUP BY day ORDER BY day DESC LIMIT ?", (limit,)
+            )
+        else:
+            rows = self._db.query(
+                "SELECT day, SUM(cost_usd) FROM usage WHERE username = ? GROUP BY day ORDER BY day DESC LIMIT ?",
+                (username, limit),
+            )
+        return sorted(rows)
+
+    def user_totals(self, day=None):
+        day = day or str(date.today())
+        return self._db.query(
+            "SELECT username, SUM(cost_usd), SUM(total_tokens), COUNT(*) FROM usage WHERE day = ? "
+            "GROUP BY username ORDER BY SUM(cost_usd) DESC",
+            (day,),
+        )
+
+
+_ledger = None
+_ledger_lock = threading.Lock()
+
+
+def get_usage_ledger():
+    global _ledger
+    with _ledger_lock:
+        if _ledger is None:
+            _ledger = UsageLedger()
+        return _ledger